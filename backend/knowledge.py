@@ -0,0 +1,116 @@
+# --------------------------------------------------------------
+# knowledge.py
+# --------------------------------------------------------------
+# Local design answer engine used by the chat and dialogue fallbacks.
+# design_knowledge.json holds per-style color / furniture / lighting
+# answers, style insights and the voiceover style prompts (whose feature
+# lists double as style overviews). A BM25 index over them is built once
+# at startup; lookups touch only the postings of the query's terms and
+# take well under a millisecond, so fallback answers stay specific when
+# LM Studio is slow or offline. Pure Python, no FastAPI imports.
+import json
+import math
+import re
+from collections import Counter, defaultdict
+
+STOPWORDS = {
+    "a", "an", "the", "this", "i", "me", "my", "we", "our", "you", "your", "is", "are", "am", "be", "do", "does", "can",
+    "could", "should", "would", "will", "what", "which", "how", "please", "for", "to", "of", "in", "on", "with",
+    "and", "or", "some", "any", "good", "best", "give", "tell", "about", "there", "like", "use", "want", "need",
+}
+# Words nearly every message shares ("thanks, I love this design", "help
+# with my room"). They are kept for answer-cache keys but carry no signal
+# for retrieval, so they neither pick an answer nor make a question answerable.
+GENERIC_TERMS = {
+    "design", "room", "space", "home", "house", "interior", "decor", "that", "it", "love", "help", "thank",
+    "thanks", "advice", "suggestion", "make", "get", "great", "nice", "so", "really", "just",
+}
+# "... Describe this {style} room, emphasizing sleek lines, bold colors. Under 40 words."
+STYLE_PROMPT_FEATURES = re.compile(r"Describe this \{style\} room, (?:emphasizing|highlighting|mentioning|noting) (.+?)\. Under")
+
+def stem(word: str) -> str:
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+def tokenize(text: str) -> list:
+    """Lowercased content words with punctuation, stopwords and plural "s" removed."""
+    return [stem(word) for word in re.findall(r"[a-z0-9']+", text.lower()) if word not in STOPWORDS]
+
+class DesignKnowledge:
+    """BM25 retrieval over design answers. Each document is (style, topic,
+    text) and is indexed by its text, style name and topic; queries that
+    use a topic's synonyms ("palette", "sofa", "lamp") also match it."""
+
+    def __init__(self, data: dict, k1: float = 1.5, b: float = 0.75):
+        self.style_prompts = data["style_prompts"]
+        self.default_style_prompt = data["default_style_prompt"]
+        self.topics = {topic: {stem(word) for word in words} | {topic} for topic, words in data["topics"].items()}
+        self.docs = [(entry["style"], entry["topic"], entry["text"]) for entry in data["answers"]]
+        for style, prompt in self.style_prompts.items():
+            match = STYLE_PROMPT_FEATURES.search(prompt)
+            if match: self.docs.append((style, "style", f"{style} design is all about {match.group(1)}."))
+        self.k1, self.b = k1, b
+        self.postings = defaultdict(list)  # term -> [(doc index, term frequency)]
+        self.lengths = []
+        for index, (style, topic, text) in enumerate(self.docs):
+            terms = Counter(tokenize(text) + tokenize(style) + [topic])
+            self.lengths.append(sum(terms.values()))
+            for term, count in terms.items(): self.postings[term].append((index, count))
+        self.average_length = sum(self.lengths) / max(len(self.lengths), 1)
+        self.idf = {term: math.log(1 + (len(self.docs) - len(hits) + 0.5) / (len(hits) + 0.5)) for term, hits in self.postings.items()}
+
+    @classmethod
+    def load(cls, path: str) -> "DesignKnowledge":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def _scores(self, terms: list) -> dict:
+        scores = defaultdict(float)
+        for term in terms:
+            for index, count in self.postings.get(term, ()):
+                norm = count + self.k1 * (1 - self.b + self.b * self.lengths[index] / self.average_length)
+                scores[index] += self.idf[term] * count * (self.k1 + 1) / norm
+        return scores
+
+    def answer(self, question: str, style: str, min_score: float = 3.0, require_topic: bool = False):
+        """Best-matching answer text, or None; see lookup()."""
+        return self.lookup(question, style, min_score, require_topic)[0]
+
+    def lookup(self, question: str, style: str, min_score: float = 3.0, require_topic: bool = False) -> tuple:
+        """(answer, exact). The answer is None if the question is not
+        answerable from the knowledge base: it must ask about a topic
+        (color, furniture, lighting), name a style, or have content words
+        scoring at least `min_score`. With `require_topic` it must ask
+        about a topic and score at least `min_score`. Among matching
+        answers, those on the question's topic come first, then those for
+        its style (a style named in the question, else the current one),
+        then by BM25 score. If only other styles match, the style's own
+        overview is returned. `exact` is True when the answer is the
+        style's own answer on the question's topic."""
+        terms = [term for term in tokenize(question) if term not in GENERIC_TERMS]
+        topics = {topic for topic, words in self.topics.items() if words.intersection(terms)}
+        scores = self._scores(terms + sorted(topics))
+        if not scores: return None, False
+        best = max(scores.values())
+        # "french country" names French Country, not Country
+        named = sorted((doc_style for doc_style in self.style_prompts if set(tokenize(doc_style)) <= set(terms)), key=lambda name: -len(tokenize(name)))
+        asks_topic = bool(topics - {"style"})
+        if require_topic:
+            if not asks_topic or best < min_score: return None, False
+        elif not (asks_topic or named or best >= min_score): return None, False
+        target = named[0] if named else style
+        def rank(index):
+            doc_style, topic, _ = self.docs[index]
+            return (topic in topics, doc_style == target, scores[index])
+        doc_style, topic, text = self.docs[max(scores, key=rank)]
+        if doc_style != target and target in self.style_prompts: return self.about(target), False
+        return text, doc_style == target and topic in topics - {"style"}
+
+    def about(self, style: str):
+        """A general insight about a style, or None if it is unknown."""
+        return next((text for doc_style, topic, text in self.docs if doc_style == style and topic == "style"), None)
+
+    def style_prompt(self, style: str) -> str:
+        return self.style_prompts.get(style, self.default_style_prompt).format(style=style)
+
+    def stats(self) -> dict:
+        return {"documents": len(self.docs), "terms": len(self.postings), "styles": len({style for style, _, _ in self.docs})}
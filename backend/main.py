@@ -1,8 +1,8 @@
 # --------------------------------------------------------------
 # main.py
 # --------------------------------------------------------------
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, StreamingResponse, Response, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
@@ -14,10 +14,26 @@ import os
 from dotenv import load_dotenv
 import logging
 import traceback
+import importlib.util
 import httpx
 import random
+import asyncio
+import time
+import json
+import uuid
+import hashlib
+import re
+import threading
+import math
+import contextvars
+import multiprocessing
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime
 import numpy as np
+from backend.recolor import recolor_image
+from backend.knowledge import DesignKnowledge, tokenize
 
 # Optional ElevenLabs import
 try:
@@ -27,7 +43,6 @@ except Exception:
 
 # HuggingFace integration for character generation and dialogue
 try:
-    import requests
     HF_API_URL = "https://api-inference.huggingface.co/models/"
     HF_TOKEN = os.getenv("HUGGINGFACE_API_KEY")  # Standardized name
     HF_HEADERS = {"Authorization": f"Bearer {HF_TOKEN}"} if HF_TOKEN else {}
@@ -71,7 +86,21 @@ if os.path.exists('.env'):
 elif os.path.exists('backend/.env'):
     load_dotenv('backend/.env')
 
-app = FastAPI(title="AI Room Designer API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background workers after startup and stop them on shutdown."""
+    open_http_clients()
+    reconstruct_jobs.start()
+    health_prober.start()
+    warmup = asyncio.create_task(warm_up_assets()) if WARMUP_ENABLED else None
+    yield
+    if warmup: warmup.cancel()
+    await reconstruct_jobs.stop()
+    await health_prober.stop()
+    await close_http_clients()
+    if recolor_executor: recolor_executor.shutdown(wait=False, cancel_futures=True)
+
+app = FastAPI(title="AI Room Designer API", lifespan=lifespan)
 logger = logging.getLogger("uvicorn.error")
 
 # --------------------------------------------------------------
@@ -85,6 +114,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Who is calling, for per-client fairness in the fal scheduler: an explicit
+# X-Client-Id header, else the first X-Forwarded-For hop, else the peer.
+current_client = contextvars.ContextVar("current_client", default="anonymous")
+
+class ClientIdentityMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            headers = dict(scope.get("headers") or [])
+            client = headers.get(b"x-client-id") or headers.get(b"x-forwarded-for", b"").split(b",")[0].strip()
+            current_client.set(client.decode("latin-1") if client else (scope.get("client") or ("anonymous",))[0])
+        await self.app(scope, receive, send)
+
+app.add_middleware(ClientIdentityMiddleware)
+
 # --------------------------------------------------------------
 # 3️⃣  API Client Configurations
 # --------------------------------------------------------------
@@ -142,11 +188,67 @@ DESIGNER_QUOTES = [
     "Innovation is often the ability to reach into the past and bring back what is good, what is beautiful, what is useful, what is lasting."
 ]
 
+NARRATOR_VOICE_ID = "21m00Tcm4TlvDq8ikWAM"
+
+# Character-specific voice IDs and personalities
+CHARACTER_VOICES = {
+    "turtle": {
+        "voice_id": "21m00Tcm4TlvDq8ikWAM",  # Deep, calm voice
+        "personality": "zen, slow, wise",
+        "prefix": "*speaks slowly and thoughtfully*"
+    },
+    "duck": {
+        "voice_id": "AZnzlk1XvdvUeBnXmlld",  # Cheerful, energetic
+        "personality": "bubbly, creative, enthusiastic", 
+        "prefix": "*quacks excitedly*"
+    },
+    "penguin": {
+        "voice_id": "EXAVITQu4vr4xnSDxMaL",  # Sophisticated, modern
+        "personality": "sleek, professional, contemporary",
+        "prefix": "*adjusts bow tie*"
+    },
+    "owl": {
+        "voice_id": "ErXwobaYiN019PkySvjV",  # Wise, technical
+        "personality": "technical, precise, knowledgeable",
+        "prefix": "*hoots thoughtfully*"
+    }
+}
+
+# Standard character dialogue per action (used when there is no user input)
+FALLBACK_DIALOGUES = {
+    "greeting": "Welcome to your {style} design journey!",
+    "3d_start": "Creating your {style} 3D masterpiece...",
+    "3d_complete": "Your {style} 3D model is ready!",
+    "download": "Your {style} design is downloading!",
+    "chat_response": "Tell me more about your {style} design vision!"
+}
+
+# Per-style color / furniture / lighting answers, style insights and the
+# 36 voiceover style prompts, indexed for local retrieval (backend/knowledge.py)
+DESIGN_KNOWLEDGE_PATH = os.getenv("DESIGN_KNOWLEDGE_PATH", os.path.join(os.path.dirname(__file__), "design_knowledge.json"))
+KNOWLEDGE_MIN_SCORE = float(os.getenv("KNOWLEDGE_MIN_SCORE", "3.0"))
+# A model that hasn't answered (or started streaming) within this budget loses
+# to the style's own knowledge-base answer on a color, furniture or lighting
+# question; 0 always waits for the model
+KNOWLEDGE_RACE_SECONDS = float(os.getenv("KNOWLEDGE_RACE_SECONDS", "3.0"))
+design_knowledge = DesignKnowledge.load(DESIGN_KNOWLEDGE_PATH)
+
 # --------------------------------------------------------------
 # 5️⃣  Pydantic Request Models
 # --------------------------------------------------------------
-class SegmentRequest(BaseModel): image_url: str
-class RecolorRequest(BaseModel): image_url: str; mask: dict; color: list
+class SegmentRequest(BaseModel):
+    image_url: str
+    inline_masks: bool = True  # False returns only mask handles
+class RecolorRequest(BaseModel):
+    image_url: str
+    mask: dict
+    color: list
+    mode: str = "shade"  # "shade" keeps lighting, "flat" pastes the color
+class RecolorLayer(BaseModel): mask: dict; color: list
+class RecolorBatchRequest(BaseModel):
+    image_url: str
+    layers: list[RecolorLayer]
+    mode: str = "shade"
 class ReconstructRequest(BaseModel): image_url: str
 class AudioRequest(BaseModel): image_url: str; style: str
 class ImageGenerateRequest(BaseModel): prompt: str
@@ -169,6 +271,1286 @@ def image_to_base64(image: Image.Image, fmt: str = "JPEG") -> str:
     image.save(buf, format=fmt)
     return base64.b64encode(buf.getvalue()).decode()
 
+class LatencyTracker:
+    """Rolling window of latency samples with percentile summaries."""
+
+    def __init__(self, window: int = 1000):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def summary(self) -> dict:
+        if not self.samples: return {"count": 0}
+        ordered = sorted(self.samples)
+        pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+        return {"count": len(ordered), "p50_ms": pick(0.50), "p99_ms": pick(0.99), "max_ms": round(ordered[-1] * 1000, 1)}
+
+    def percentile(self, q: float, default: float = None):
+        """The q-quantile in seconds, or `default` with no samples."""
+        if not self.samples: return default
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+# --------------------------------------------------------------
+# 7️⃣  Result Cache
+# --------------------------------------------------------------
+# Content-addressed cache for deterministic upstream calls. Keys hash the
+# model id plus normalized arguments; inline data: images are hashed by
+# their decoded bytes so the same photo hits regardless of encoding.
+# A small in-memory LRU sits in front of an on-disk tier with a size
+# budget and TTL.
+FAL_CACHE_ENABLED = os.getenv("FAL_CACHE_ENABLED", "true").lower() != "false"
+FAL_CACHE_DIR = os.getenv("FAL_CACHE_DIR", ".cache/fal")
+FAL_CACHE_MEMORY_ITEMS = int(os.getenv("FAL_CACHE_MEMORY_ITEMS", "512"))
+FAL_CACHE_DISK_MB = int(os.getenv("FAL_CACHE_DISK_MB", "256"))
+FAL_CACHE_TTL_SECONDS = int(os.getenv("FAL_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def _normalize_for_key(value):
+    if isinstance(value, dict):
+        return {k: _normalize_for_key(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [_normalize_for_key(v) for v in value]
+    if isinstance(value, str) and value.startswith("data:") and "," in value:
+        header, payload = value.split(",", 1)
+        raw = base64.b64decode(payload.strip()) if header.endswith(";base64") else payload.encode()
+        return f"sha256:{content_hash(raw)}"
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+def cache_key(model: str, arguments: dict) -> str:
+    """Stable hash of a model id plus its normalized arguments."""
+    normalized = json.dumps(_normalize_for_key(arguments), sort_keys=True, separators=(",", ":"))
+    return content_hash(f"{model}\n{normalized}".encode())
+
+class DiskStore:
+    """Directory of files keyed by hash, with a byte budget (LRU eviction)
+    and a TTL. Writes are atomic. Methods block, so call them through
+    run_blocking() from request handlers."""
+
+    def __init__(self, directory: str, max_bytes: int, ttl_seconds: int = 0, suffix: str = ""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.suffix = suffix
+        self.evictions = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # key -> (size, created_at), oldest access first
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            if not name.endswith(suffix) or name.startswith("."): continue
+            stat = os.stat(os.path.join(directory, name))
+            entries.append((stat.st_mtime, name[:len(name) - len(suffix)] if suffix else name, stat.st_size))
+        for mtime, key, size in sorted(entries):
+            self._index[key] = (size, mtime)
+            self._bytes += size
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def total_bytes(self) -> int:
+        return self._bytes
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None: return False
+            if self.ttl_seconds and time.time() - entry[1] > self.ttl_seconds:
+                self._remove(key)
+                return False
+            self._index.move_to_end(key)
+            return True
+
+    def read(self, key: str):
+        if not self.contains(key): return None
+        try:
+            with open(self.path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            with self._lock: self._forget(key)
+            return None
+
+    def write(self, key: str, data: bytes):
+        tmp_path = os.path.join(self.directory, f".{key}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path(key))
+        with self._lock:
+            self._forget(key)
+            self._index[key] = (len(data), time.time())
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._index))
+                if oldest == key: break
+                self._remove(oldest)
+
+    def _forget(self, key: str):
+        size, _ = self._index.pop(key, (0, 0))
+        self._bytes -= size
+
+    def _remove(self, key: str):
+        self._forget(key)
+        self.evictions += 1
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+class ResultCache:
+    """Two-tier (memory LRU + DiskStore) cache of JSON results."""
+
+    def __init__(self, name: str, memory_items: int, disk: DiskStore = None):
+        self.name = name
+        self.memory_items = memory_items
+        self.disk = disk
+        self.memory = OrderedDict()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0}
+
+    async def get(self, key: str):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.counters["memory_hits"] += 1
+            return self.memory[key]
+        if self.disk is not None:
+            raw = await run_blocking(self.disk.read, key)
+            if raw is not None:
+                value = json.loads(raw)
+                self._remember(key, value)
+                self.counters["disk_hits"] += 1
+                return value
+        self.counters["misses"] += 1
+        return None
+
+    async def set(self, key: str, value):
+        self._remember(key, value)
+        self.counters["writes"] += 1
+        if self.disk is not None:
+            try:
+                await run_blocking(self.disk.write, key, json.dumps(value).encode())
+            except OSError as exc:
+                logger.warning("%s cache disk write failed: %s", self.name, exc)
+
+    def _remember(self, key: str, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+        hits = lookups - self.counters["misses"]
+        stats = dict(self.counters, memory_items=len(self.memory), hit_rate=round(hits / lookups, 3) if lookups else 0.0)
+        if self.disk is not None:
+            stats.update(disk_items=len(self.disk._index), disk_bytes=self.disk.total_bytes(), disk_evictions=self.disk.evictions)
+        return stats
+
+fal_cache = None
+if FAL_CACHE_ENABLED:
+    try:
+        fal_cache = ResultCache("fal", FAL_CACHE_MEMORY_ITEMS, DiskStore(FAL_CACHE_DIR, FAL_CACHE_DISK_MB * 1024 * 1024, FAL_CACHE_TTL_SECONDS, ".json"))
+    except OSError as e:
+        logger.warning("fal disk cache unavailable (%s); using memory only", e)
+        fal_cache = ResultCache("fal", FAL_CACHE_MEMORY_ITEMS)
+
+# --------------------------------------------------------------
+# 8️⃣  Upstream Execution Layer
+# --------------------------------------------------------------
+# Every fal.ai call goes through run_fal() so slow models (SD3, Trellis,
+# InstantMesh) never block the event loop. We use fal's queue API
+# (submit + poll) when the installed client has it, and fall back to the
+# synchronous client on a bounded thread pool otherwise. Other blocking SDK
+# calls (ElevenLabs) go through run_blocking() on the same pool.
+FAL_RUN_TIMEOUT = float(os.getenv("FAL_RUN_TIMEOUT", "600"))
+UPSTREAM_MAX_WORKERS = int(os.getenv("UPSTREAM_MAX_WORKERS", "16"))
+
+upstream_executor = ThreadPoolExecutor(max_workers=UPSTREAM_MAX_WORKERS, thread_name_prefix="upstream")
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking callable on the bounded upstream pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(upstream_executor, lambda: func(*args, **kwargs))
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one in-flight task,
+    so double clicks and duplicate tabs don't start duplicate upstream work.
+    The shared task is shielded: a caller going away doesn't cancel it for
+    the others, but once the last caller has gone it is cancelled."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.inflight = {}
+        self.waiters = {}  # task -> callers still awaiting it
+        self.counters = {"started": 0, "coalesced": 0, "abandoned": 0}
+
+    async def do(self, key: str, func, *args, **kwargs):
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self.inflight[key] = task
+            task.add_done_callback(lambda done, key=key: self._finished(key, done))
+            self.counters["started"] += 1
+        else:
+            self.counters["coalesced"] += 1
+        self.waiters[task] = self.waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self.waiters[task] == 1 and not task.done():
+                task.cancel()
+                self.counters["abandoned"] += 1
+            raise
+        finally:
+            self.waiters[task] -= 1
+            if not self.waiters[task]: del self.waiters[task]
+
+    def _finished(self, key: str, task):
+        if self.inflight.get(key) is task: del self.inflight[key]
+        if not task.cancelled(): task.exception()  # mark retrieved if every caller left
+
+    def stats(self) -> dict:
+        return dict(self.counters, in_flight=len(self.inflight))
+
+fal_flight = SingleFlight("fal")
+
+# Per-model circuit breakers: after enough failures inside the window, or
+# a run of consecutive failures, a model's breaker opens and calls fail
+# fast (CircuitOpenError) instead of waiting on a dead upstream. After the
+# cool-down one trial call is let through (half-open); success closes the
+# breaker, failure re-opens it and doubles the cool-down (up to
+# BREAKER_MAX_COOLDOWN_SECONDS). Models called about once per reconstruction
+# (the mesh models) never see BREAKER_MIN_CALLS calls in a minute, so they
+# get a longer window and rely on the consecutive-failure trip.
+BREAKER_WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "60"))
+BREAKER_MODEL_WINDOWS = {
+    model.strip(): float(seconds)
+    for model, seconds in (item.split("=", 1) for item in os.getenv("BREAKER_MODEL_WINDOWS", "fal-ai/instant-mesh=1800,fal-ai/trellis=1800").split(",") if "=" in item)
+}
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_CONSECUTIVE_FAILURES = int(os.getenv("BREAKER_CONSECUTIVE_FAILURES", "3"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "30"))
+BREAKER_MAX_COOLDOWN_SECONDS = float(os.getenv("BREAKER_MAX_COOLDOWN_SECONDS", "900"))
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    def __init__(self, name: str, window_seconds: float = BREAKER_WINDOW_SECONDS):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.state = "closed"
+        self.calls = deque()  # (finished_at, ok) inside the window
+        self.consecutive_failures = 0
+        self.failed_trials = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.counters = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def available(self) -> bool:
+        """Would a call be let through right now? (Does not reserve the trial.)"""
+        if self.state == "closed": return True
+        if self.state == "open": return time.time() - self.opened_at >= self.cooldown()
+        return not self.trial_in_flight
+
+    def cooldown(self) -> float:
+        return min(BREAKER_COOLDOWN_SECONDS * 2 ** self.failed_trials, max(BREAKER_MAX_COOLDOWN_SECONDS, BREAKER_COOLDOWN_SECONDS))
+
+    def allow(self) -> bool:
+        if self.state == "open" and time.time() - self.opened_at >= self.cooldown():
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self.trial_in_flight:
+                self.counters["rejected"] += 1
+                return False
+            self.trial_in_flight = True
+            return True
+        if self.state == "open":
+            self.counters["rejected"] += 1
+            return False
+        return True
+
+    def record(self, ok: bool):
+        now = time.time()
+        self.counters["successes" if ok else "failures"] += 1
+        self.consecutive_failures = 0 if ok else self.consecutive_failures + 1
+        if self.state == "half_open":
+            self.trial_in_flight = False
+            if ok:
+                self.state = "closed"
+                self.calls.clear()
+                self.failed_trials = 0
+            else:
+                self.failed_trials += 1
+                self._open(now)
+            return
+        self.calls.append((now, ok))
+        while self.calls and now - self.calls[0][0] > self.window_seconds:
+            self.calls.popleft()
+        failures = sum(1 for _, call_ok in self.calls if not call_ok)
+        if self.state != "closed": return
+        if len(self.calls) >= BREAKER_MIN_CALLS and failures / len(self.calls) >= BREAKER_FAILURE_RATE:
+            self._open(now)
+        elif BREAKER_CONSECUTIVE_FAILURES > 0 and self.consecutive_failures >= BREAKER_CONSECUTIVE_FAILURES:
+            self._open(now)
+
+    def release(self):
+        """The trial call ended without an outcome (e.g. cancelled)."""
+        if self.state == "half_open": self.trial_in_flight = False
+
+    def _open(self, now: float):
+        self.state = "open"
+        self.opened_at = now
+        self.counters["opened"] += 1
+        print(f"🔌 Circuit open for {self.name} (cool-down {self.cooldown():.0f}s)")
+
+    def stats(self) -> dict:
+        failures = sum(1 for _, ok in self.calls if not ok)
+        return dict(self.counters, state=self.state, window_s=self.window_seconds, window_calls=len(self.calls), window_failure_rate=round(failures / len(self.calls), 3) if self.calls else 0.0, consecutive_failures=self.consecutive_failures, cooldown_s=self.cooldown())
+
+circuit_breakers = {}
+
+def circuit_breaker(model: str) -> CircuitBreaker:
+    if model not in circuit_breakers: circuit_breakers[model] = CircuitBreaker(model, BREAKER_MODEL_WINDOWS.get(model, BREAKER_WINDOW_SECONDS))
+    return circuit_breakers[model]
+
+# Admission control: every fal call holds a slot under a global cap and
+# its model's cap. Waiting calls are served interactive before batch and
+# round-robin across clients within a class. Each class's wait queue is
+# bounded on its own: interactive calls beyond FAL_QUEUE_LIMIT waiting
+# interactive calls, and new reconstructions beyond FAL_BATCH_QUEUE_LIMIT
+# waiting batch calls, get a 429 with Retry-After. Calls inside an already
+# admitted reconstruction always wait, and a batch backlog never turns
+# interactive calls away, since those are dispatched ahead of it.
+FAL_MAX_CONCURRENT = int(os.getenv("FAL_MAX_CONCURRENT", "12"))
+FAL_MODEL_MAX_CONCURRENT = int(os.getenv("FAL_MODEL_MAX_CONCURRENT", "8"))
+FAL_MODEL_LIMITS = {
+    model.strip(): int(limit)
+    for model, limit in (item.split("=", 1) for item in os.getenv("FAL_MODEL_LIMITS", "fal-ai/instant-mesh=2,fal-ai/trellis=2").split(",") if "=" in item)
+}
+FAL_QUEUE_LIMIT = int(os.getenv("FAL_QUEUE_LIMIT", "64"))
+FAL_BATCH_QUEUE_LIMIT = int(os.getenv("FAL_BATCH_QUEUE_LIMIT", "256"))
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+
+class FalQueueFull(HTTPException):
+    def __init__(self, retry_after: int):
+        super().__init__(status_code=429, detail="Image services are busy, please retry shortly", headers={"Retry-After": str(retry_after)})
+
+class FalScheduler:
+    def __init__(self, max_concurrent: int, default_model_limit: int, model_limits: dict, queue_limit: int, batch_queue_limit: int):
+        self.max_concurrent = max_concurrent
+        self.default_model_limit = default_model_limit
+        self.model_limits = model_limits
+        self.queue_limits = {PRIORITY_INTERACTIVE: queue_limit, PRIORITY_BATCH: batch_queue_limit}
+        self.running = 0
+        self.running_by_model = {}
+        self.waiting = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0}
+        self.queues = {PRIORITY_INTERACTIVE: OrderedDict(), PRIORITY_BATCH: OrderedDict()}  # client -> deque of (model, future)
+        self.service_seconds = 10.0  # moving average of slot hold time, for Retry-After
+        self.counters = {"admitted": 0, "queued": 0, "rejected": 0}
+
+    def model_limit(self, model: str) -> int:
+        return self.model_limits.get(model, self.default_model_limit)
+
+    def retry_after(self, priority: str = PRIORITY_INTERACTIVE) -> int:
+        # Interactive calls only wait behind other interactive calls
+        ahead = self.waiting[PRIORITY_INTERACTIVE] if priority == PRIORITY_INTERACTIVE else sum(self.waiting.values())
+        return max(1, math.ceil(self.service_seconds * (ahead + 1) / self.max_concurrent))
+
+    def admit(self, priority: str = PRIORITY_INTERACTIVE):
+        """Front-door check for new work; raises FalQueueFull when the wait
+        queue of its priority class is full."""
+        if self.waiting[priority] >= self.queue_limits[priority]:
+            self.counters["rejected"] += 1
+            raise FalQueueFull(self.retry_after(priority))
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: str = PRIORITY_INTERACTIVE, client: str = "anonymous", may_reject: bool = True):
+        if may_reject: self.admit(priority)
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues[priority].setdefault(client, deque()).append((model, waiter))
+        self.waiting[priority] += 1
+        self._dispatch()
+        if not waiter.done(): self.counters["queued"] += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                self._discard(priority, client, waiter)
+                work_avoided["fal_calls_dropped_from_queue"] += 1
+            else:
+                self._release(model)  # granted just as the caller went away
+            raise
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.service_seconds = 0.8 * self.service_seconds + 0.2 * (time.perf_counter() - started)
+            self._release(model)
+
+    def _dispatch(self):
+        for priority in (PRIORITY_INTERACTIVE, PRIORITY_BATCH):
+            clients = self.queues[priority]
+            granted = True
+            while granted and self.running < self.max_concurrent:
+                granted = False
+                # One call per client per pass, so a burst from one client can't starve others
+                for client in list(clients):
+                    if self.running >= self.max_concurrent: return
+                    waiters = clients[client]
+                    served = False
+                    for index, (model, waiter) in enumerate(waiters):
+                        if self.running_by_model.get(model, 0) < self.model_limit(model):
+                            del waiters[index]
+                            self._grant(priority, model, waiter)
+                            granted = served = True
+                            break
+                    # Only a client that got a slot goes to the back of the line
+                    if not waiters: del clients[client]
+                    elif served: clients.move_to_end(client)
+
+    def _grant(self, priority: str, model: str, waiter):
+        self.waiting[priority] -= 1
+        self.running += 1
+        self.running_by_model[model] = self.running_by_model.get(model, 0) + 1
+        self.counters["admitted"] += 1
+        waiter.set_result(None)
+
+    def _release(self, model: str):
+        self.running -= 1
+        self.running_by_model[model] -= 1
+        self._dispatch()
+
+    def _discard(self, priority: str, client: str, waiter):
+        waiters = self.queues[priority].get(client)
+        if not waiters: return
+        for index, (_, queued) in enumerate(waiters):
+            if queued is waiter:
+                del waiters[index]
+                self.waiting[priority] -= 1
+                break
+        if not waiters: del self.queues[priority][client]
+
+    def stats(self) -> dict:
+        return dict(
+            self.counters,
+            running=self.running,
+            waiting=sum(self.waiting.values()),
+            waiting_by_priority=dict(self.waiting),
+            running_by_model={model: count for model, count in self.running_by_model.items() if count},
+            retry_after_s=self.retry_after(),
+        )
+
+fal_scheduler = FalScheduler(FAL_MAX_CONCURRENT, FAL_MODEL_MAX_CONCURRENT, FAL_MODEL_LIMITS, FAL_QUEUE_LIMIT, FAL_BATCH_QUEUE_LIMIT)
+
+# Application-lifetime HTTP connection pools, one per upstream, so chat and
+# HF calls reuse keep-alive connections instead of paying TCP/TLS setup on
+# every request. Created and closed by the lifespan hook.
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "60"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "8"))
+HF_MAX_CONNECTIONS = int(os.getenv("HF_MAX_CONNECTIONS", "8"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "32"))
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+http_clients = {}
+
+def _pooled_client(max_connections: int, **kwargs) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections, keepalive_expiry=60.0),
+        timeout=httpx.Timeout(UPSTREAM_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+        **kwargs,
+    )
+
+def open_http_clients():
+    llm_headers = {"Authorization": f"Bearer {GPT_OSS_API_KEY}"} if GPT_OSS_API_KEY else {}
+    http_clients["llm"] = _pooled_client(LLM_MAX_CONNECTIONS, base_url=GPT_OSS_API_URL.rstrip("/") + "/", headers=llm_headers)
+    http_clients["hf"] = _pooled_client(HF_MAX_CONNECTIONS, base_url=HF_API_URL, headers=HF_HEADERS)
+    http_clients["default"] = _pooled_client(HTTP_MAX_CONNECTIONS)
+    print(f"✅ Upstream HTTP pools ready (HTTP/2 {'on' if HTTP2_AVAILABLE else 'off'})")
+
+async def close_http_clients():
+    for client in http_clients.values(): await client.aclose()
+    http_clients.clear()
+
+async def run_fal(model: str, arguments: dict, timeout: float = None, cache: bool = True, priority: str = PRIORITY_INTERACTIVE) -> dict:
+    """Await a fal.ai model call without blocking the event loop. Results
+    are served from / stored in fal_cache unless cache=False, identical
+    concurrent calls share one upstream request, and calls to a model whose
+    circuit breaker is open fail fast with CircuitOpenError. The upstream
+    call waits for a fal_scheduler slot in the given priority class."""
+    key = cache_key(model, arguments)
+    use_cache = cache and fal_cache is not None
+    if use_cache:
+        cached = await fal_cache.get(key)
+        if cached is not None: return cached
+    if key not in fal_flight.inflight and not circuit_breaker(model).allow():
+        raise CircuitOpenError(f"{model} is failing; circuit open")
+    return await fal_flight.do(key, _call_and_store_fal, model, arguments, timeout or FAL_RUN_TIMEOUT, use_cache, key, priority)
+
+async def _call_and_store_fal(model: str, arguments: dict, timeout: float, use_cache: bool, key: str, priority: str) -> dict:
+    breaker = circuit_breaker(model)
+    try:
+        async with fal_scheduler.slot(model, priority, current_client.get(), may_reject=priority == PRIORITY_INTERACTIVE):
+            result = await _call_fal(model, arguments, timeout)
+    except FalQueueFull:
+        breaker.release()
+        raise
+    except Exception:
+        breaker.record(False)
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+    breaker.record(True)
+    if use_cache: await fal_cache.set(key, result)
+    return result
+
+async def _call_fal(model: str, arguments: dict, timeout: float) -> dict:
+    if hasattr(fal_client, "submit_async"):
+        handle = await fal_client.submit_async(model, arguments=arguments)
+        try:
+            return await asyncio.wait_for(handle.get(), timeout=timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            # Nobody will read this result any more; stop fal computing it
+            run_in_background(_cancel_fal_request(model, handle))
+            raise
+    return await asyncio.wait_for(run_blocking(fal_client.run, model, arguments=arguments), timeout=timeout)
+
+async def _cancel_fal_request(model: str, handle):
+    try:
+        await handle.cancel()
+        work_avoided["fal_requests_cancelled"] += 1
+    except Exception as e:
+        print(f"   ⚠️ Could not cancel {model} request {getattr(handle, 'request_id', '?')}: {e}")
+
+background_tasks = set()
+
+def run_in_background(coro):
+    """Fire-and-forget a coroutine, keeping a reference until it finishes."""
+    task = asyncio.ensure_future(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# Deadlines and cancellation: multi-stage pipelines get a total time budget
+# that is split across their stages by weight (time a stage doesn't use
+# carries over to the later ones). When a stage runs out of budget, or the
+# client disconnects, the remaining stages never start and in-flight fal
+# requests are cancelled upstream. work_avoided counts what that saved.
+RECONSTRUCT_DEADLINE_SECONDS = float(os.getenv("RECONSTRUCT_DEADLINE_SECONDS", "900"))
+REDESIGN_DEADLINE_SECONDS = float(os.getenv("REDESIGN_DEADLINE_SECONDS", "240"))
+RECONSTRUCT_STAGE_WEIGHTS = {"upscale": 1, "scene_description": 0.5, "views": 4, "instant_mesh": 3, "trellis": 1.5}
+REDESIGN_STAGE_WEIGHTS = {"describe": 1, "generate": 2}
+
+work_avoided = {
+    "requests_abandoned": 0,
+    "deadlines_exceeded": 0,
+    "fal_requests_cancelled": 0,
+    "fal_calls_dropped_from_queue": 0,
+    "stages_skipped": 0,
+    "views_cancelled": 0,
+}
+
+class DeadlineExceeded(Exception):
+    pass
+
+class ClientDisconnected(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=499, detail="Client closed request")
+
+class Deadline:
+    def __init__(self, seconds: float, weights: dict):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.weights = dict(weights)  # stages not started yet
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def skip(self, *stages):
+        for stage in stages: self.weights.pop(stage, None)
+
+    def budget(self, stage: str) -> float:
+        """Seconds for `stage`: what is left, shared by weight among the stages still to run."""
+        weight = self.weights.pop(stage, 0)
+        total = weight + sum(self.weights.values())
+        return self.remaining() * weight / total if total else self.remaining()
+
+    async def run(self, stage: str, awaitable, budget: float = None):
+        budget = self.budget(stage) if budget is None else budget
+        try:
+            return await asyncio.wait_for(awaitable, timeout=max(budget, 0.001))
+        except asyncio.TimeoutError:
+            work_avoided["deadlines_exceeded"] += 1
+            raise DeadlineExceeded(f"{stage} ran out of its {budget:.0f}s budget")
+
+async def _wait_for_disconnect(request: Request):
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+async def run_until_disconnect(request: Request, awaitable):
+    """Await `awaitable`, cancelling it (and the upstream work under it) if
+    the client disconnects first; raises ClientDisconnected in that case."""
+    work = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if work.done(): return work.result()
+        work_avoided["requests_abandoned"] += 1
+        work.cancel()
+        await asyncio.gather(work, return_exceptions=True)
+        raise ClientDisconnected()
+    finally:
+        watcher.cancel()
+        if not work.done(): work.cancel()
+
+def synthesize_speech(**kwargs) -> bytes:
+    """Run an ElevenLabs conversion to completion and return the mp3 bytes."""
+    return b"".join(eleven_client.text_to_speech.convert(**kwargs))
+
+# --------------------------------------------------------------
+# 9️⃣  Background Job Workers
+# --------------------------------------------------------------
+# Long pipelines (3D reconstruction) run as jobs on a local worker pool so
+# the HTTP request that submits them returns immediately. Clients poll the
+# job or follow its progress events over SSE, and can reconnect with the
+# job id instead of restarting the pipeline.
+RECONSTRUCT_MAX_CONCURRENT_JOBS = int(os.getenv("RECONSTRUCT_MAX_CONCURRENT_JOBS", "2"))
+RECONSTRUCT_JOB_QUEUE_SIZE = int(os.getenv("RECONSTRUCT_JOB_QUEUE_SIZE", "20"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+
+class JobQueueFull(Exception):
+    pass
+
+class JobManager:
+    """In-memory job store plus a fixed pool of asyncio worker tasks."""
+
+    def __init__(self, name: str, max_workers: int, max_queued: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.jobs = {}
+        self.coalesced = 0
+        self.queue = None
+        self.workers = []
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_queued)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+        print(f"✅ {self.name} job workers started ({self.max_workers} concurrent)")
+
+    async def stop(self):
+        for worker in self.workers: worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def submit(self, runner, *args, dedupe_key: str = None) -> dict:
+        """Queue runner(*args, progress) and return the new job record. If a
+        queued or running job has the same dedupe_key, that job is returned
+        instead of starting a duplicate."""
+        self._prune()
+        if dedupe_key:
+            for existing in self.jobs.values():
+                if existing["dedupe_key"] == dedupe_key and existing["status"] in ("queued", "running"):
+                    self.coalesced += 1
+                    return existing
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "dedupe_key": dedupe_key,
+            "status": "queued",
+            "stage": None,
+            "events": [],
+            "result": None,
+            "error": None,
+            "client": current_client.get(),
+            "created_at": time.time(),
+            "updated_at": time.time(),
+            "changed": asyncio.Event(),
+        }
+        try:
+            self.queue.put_nowait((job_id, runner, args))
+        except asyncio.QueueFull:
+            raise JobQueueFull(f"{self.name} queue is full")
+        self.jobs[job_id] = job
+        self._publish(job, "queued", "Waiting for a free worker", position=self.queue.qsize())
+        return job
+
+    def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    def snapshot(self, job: dict) -> dict:
+        """JSON-safe view of a job for the status endpoint."""
+        return {
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "stage": job["stage"],
+            "progress": job["events"][-1] if job["events"] else None,
+            "result": job["result"],
+            "error": job["error"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+        }
+
+    async def events(self, job_id: str, keepalive: float = 15.0):
+        """Yield every progress event of a job, replaying past ones first,
+        until the job finishes."""
+        job = self.jobs[job_id]
+        sent = 0
+        while True:
+            changed = job["changed"]
+            while sent < len(job["events"]):
+                yield job["events"][sent]
+                sent += 1
+            if job["status"] in ("completed", "failed"):
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield None  # keep-alive
+
+    def _publish(self, job: dict, stage: str, message: str, **details):
+        job["stage"] = stage
+        job["updated_at"] = time.time()
+        job["events"].append({"stage": stage, "message": message, "timestamp": job["updated_at"], **details})
+        # Wake every listener, then hand out a fresh event for the next change
+        job["changed"].set()
+        job["changed"] = asyncio.Event()
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [j for j, job in self.jobs.items() if job["status"] in ("completed", "failed") and job["updated_at"] < cutoff]:
+            del self.jobs[job_id]
+
+    async def _worker(self):
+        while True:
+            job_id, runner, args = await self.queue.get()
+            job = self.jobs[job_id]
+            job["status"] = "running"
+            current_client.set(job["client"])
+            try:
+                job["result"] = await runner(*args, lambda stage, message, **details: self._publish(job, stage, message, **details))
+                job["status"] = "completed"
+                self._publish(job, "done", "Job completed")
+            except asyncio.CancelledError:
+                job["status"] = "failed"
+                job["error"] = "Server shutting down"
+                self._publish(job, "failed", job["error"])
+                raise
+            except Exception as exc:
+                logger.exception("❌ %s job %s failed: %s", self.name, job_id, exc)
+                job["status"] = "failed"
+                job["error"] = str(exc)
+                self._publish(job, "failed", str(exc))
+            finally:
+                self.queue.task_done()
+
+reconstruct_jobs = JobManager("Reconstruction", RECONSTRUCT_MAX_CONCURRENT_JOBS, RECONSTRUCT_JOB_QUEUE_SIZE)
+
+# --------------------------------------------------------------
+# 🔟  Image Handles
+# --------------------------------------------------------------
+# Clients upload an image once to /images and then pass the returned
+# image_id wherever an image_url is expected. Bytes are kept in memory and
+# on disk, decoded at most once for local work (recolor) and uploaded to
+# fal lazily, at most once per image.
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", ".cache/images")
+IMAGE_STORE_MEMORY_MB = int(os.getenv("IMAGE_STORE_MEMORY_MB", "128"))
+IMAGE_STORE_DISK_MB = int(os.getenv("IMAGE_STORE_DISK_MB", "1024"))
+IMAGE_STORE_TTL_SECONDS = int(os.getenv("IMAGE_STORE_TTL_SECONDS", str(7 * 24 * 3600)))
+IMAGE_ID_PREFIX = "img_"
+
+def is_image_id(value: str) -> bool:
+    return isinstance(value, str) and value.startswith(IMAGE_ID_PREFIX) and len(value) == len(IMAGE_ID_PREFIX) + 32
+
+class ImageStore:
+    """Content-addressed image bytes: memory LRU in front of a DiskStore,
+    plus memoized decoded images and fal upload URLs."""
+
+    def __init__(self, max_memory_bytes: int, disk: DiskStore = None):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk = disk
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.fal_urls = {}
+        self.uploads = SingleFlight("fal-upload")
+        self.counters = {"stored": 0, "deduplicated": 0, "fal_uploads": 0, "fal_upload_reuses": 0}
+
+    async def put(self, data: bytes) -> str:
+        image_id = IMAGE_ID_PREFIX + content_hash(data)[:32]
+        if image_id in self.memory or (self.disk is not None and await run_blocking(self.disk.contains, image_id)):
+            self.counters["deduplicated"] += 1
+        else:
+            self.counters["stored"] += 1
+            if self.disk is not None: await run_blocking(self.disk.write, image_id, data)
+        self._remember(image_id, data)
+        return image_id
+
+    async def get(self, image_id: str):
+        if image_id in self.memory:
+            self.memory.move_to_end(image_id)
+            return self.memory[image_id]
+        data = await run_blocking(self.disk.read, image_id) if self.disk is not None else None
+        if data is not None: self._remember(image_id, data)
+        return data
+
+    async def require(self, image_id: str) -> bytes:
+        data = await self.get(image_id)
+        if data is None: raise HTTPException(status_code=404, detail=f"Unknown or expired image id {image_id}, please upload again")
+        return data
+
+    async def fal_url(self, image_id: str) -> str:
+        if image_id in self.fal_urls:
+            self.counters["fal_upload_reuses"] += 1
+            return self.fal_urls[image_id]
+        return await self.uploads.do(image_id, self._upload, image_id)
+
+    async def _upload(self, image_id: str) -> str:
+        data = await self.require(image_id)
+        fmt = (Image.open(io.BytesIO(data)).format or "PNG").lower()
+        url = await fal_client.upload_async(data, f"image/{fmt}", file_name=f"{image_id}.{fmt}")
+        self.fal_urls[image_id] = url
+        self.counters["fal_uploads"] += 1
+        return url
+
+    def _remember(self, image_id: str, data: bytes):
+        if image_id not in self.memory: self.memory_bytes += len(data)
+        self.memory[image_id] = data
+        self.memory.move_to_end(image_id)
+        while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        stats = dict(self.counters, memory_items=len(self.memory), memory_bytes=self.memory_bytes)
+        if self.disk is not None: stats.update(disk_items=len(self.disk._index), disk_bytes=self.disk.total_bytes())
+        return stats
+
+try:
+    image_store = ImageStore(IMAGE_STORE_MEMORY_MB * 1024 * 1024, DiskStore(IMAGE_STORE_DIR, IMAGE_STORE_DISK_MB * 1024 * 1024, IMAGE_STORE_TTL_SECONDS))
+except OSError as e:
+    logger.warning("Image disk store unavailable (%s); using memory only", e)
+    image_store = ImageStore(IMAGE_STORE_MEMORY_MB * 1024 * 1024)
+
+async def resolve_image_url(image_url: str) -> str:
+    """Turn an image_id into a fal-hosted URL; other URLs pass through."""
+    return await image_store.fal_url(image_url) if is_image_id(image_url) else image_url
+
+async def load_image_bytes(image_url: str) -> bytes:
+    """Encoded image bytes for an image_id or a base64 data URL."""
+    if is_image_id(image_url): return await image_store.require(image_url)
+    b64 = image_url.split(",", 1)[1] if image_url.startswith("data:image") else image_url
+    return base64.b64decode(b64.strip())
+
+# --------------------------------------------------------------
+# 1️⃣1️⃣  Speech Delivery
+# --------------------------------------------------------------
+# Generated speech is fully determined by (voice_id, model_id, text), so
+# clips live in a content-addressed store (memory LRU in front of a
+# DiskStore with a byte budget) and are served from /speech/<key>.mp3.
+# In "stream" mode the voice endpoints return that URL right away;
+# fetching it relays ElevenLabs chunks as they arrive, so an <audio>
+# element starts playing after the first chunk, and the finished clip is
+# teed into the store. "file" mode synthesizes into the store before
+# returning. Either way repeats are served without calling ElevenLabs.
+VOICE_DELIVERY = os.getenv("VOICE_DELIVERY", "stream").lower()
+SPEECH_TICKET_TTL_SECONDS = int(os.getenv("SPEECH_TICKET_TTL_SECONDS", "900"))
+SPEECH_STORE_DIR = os.getenv("SPEECH_STORE_DIR", ".cache/speech")
+SPEECH_STORE_MEMORY_MB = int(os.getenv("SPEECH_STORE_MEMORY_MB", "32"))
+SPEECH_STORE_DISK_MB = int(os.getenv("SPEECH_STORE_DISK_MB", "256"))
+SPEECH_KEY_PREFIX = "sp_"
+
+def speech_key(synthesis: dict) -> str:
+    """Content address of a clip: hash of voice, model and text."""
+    identity = {"voice_id": synthesis.get("voice_id"), "model_id": synthesis.get("model_id", ""), "text": synthesis.get("text", "")}
+    return SPEECH_KEY_PREFIX + cache_key("elevenlabs", identity)[:32]
+
+async def stream_speech(**kwargs):
+    """Yield mp3 chunks from ElevenLabs as they are produced. The SDK
+    iterator blocks, so each chunk is pulled on the upstream executor."""
+    tts = eleven_client.text_to_speech
+    chunks = iter(await run_blocking(tts.stream if hasattr(tts, "stream") else tts.convert, **kwargs))
+    try:
+        while True:
+            chunk = await run_blocking(next, chunks, None)
+            if chunk is None: break
+            if chunk: yield chunk
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            try:
+                close()
+            except ValueError:
+                pass  # still running on the executor thread; it finishes on its own
+
+class SpeechStore:
+    """Synthesized clips by speech_key(): memory LRU over a DiskStore,
+    plus the synthesis arguments of clips issued but not yet rendered
+    (they expire after SPEECH_TICKET_TTL_SECONDS)."""
+
+    def __init__(self, ttl_seconds: int, max_memory_bytes: int, disk: DiskStore = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.disk = disk
+        self.pending = OrderedDict()  # key -> (synthesis kwargs, issued_at)
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.renders = SingleFlight("speech")
+        self.counters = {"issued": 0, "hits": 0, "misses": 0, "streams": 0, "rendered": 0, "aborted": 0}
+
+    def issue(self, synthesis: dict) -> str:
+        key = speech_key(synthesis)
+        self.pending[key] = (synthesis, time.time())
+        self.pending.move_to_end(key)
+        self.counters["issued"] += 1
+        while self.pending and time.time() - next(iter(self.pending.values()))[1] > self.ttl_seconds:
+            self.pending.popitem(last=False)
+        return key
+
+    def lookup(self, key: str):
+        entry = self.pending.get(key)
+        if entry is None or time.time() - entry[1] > self.ttl_seconds: return None
+        return entry[0]
+
+    async def get(self, key: str):
+        audio = self.memory.get(key)
+        if audio is None and self.disk is not None:
+            audio = await run_blocking(self.disk.read, key)
+        if audio is None:
+            self.counters["misses"] += 1
+            return None
+        self.counters["hits"] += 1
+        self._remember(key, audio)
+        return audio
+
+    async def put(self, key: str, audio: bytes):
+        self._remember(key, audio)
+        self.counters["rendered"] += 1
+        if self.disk is not None:
+            try:
+                await run_blocking(self.disk.write, key, audio)
+            except OSError as exc:
+                logger.warning("Speech store disk write failed: %s", exc)
+
+    async def render(self, synthesis: dict) -> str:
+        """Make sure the clip exists in the store (synthesizing it at most
+        once for concurrent callers) and return its key."""
+        key = self.issue(synthesis)
+        if await self.get(key) is None:
+            await self.renders.do(key, self._render, key, synthesis)
+        return key
+
+    async def _render(self, key: str, synthesis: dict):
+        await self.put(key, await run_blocking(synthesize_speech, **synthesis))
+
+    def _remember(self, key: str, audio: bytes):
+        if len(audio) > self.max_memory_bytes: return
+        if key not in self.memory: self.memory_bytes += len(audio)
+        self.memory[key] = audio
+        self.memory.move_to_end(key)
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        stats = dict(self.counters, delivery=VOICE_DELIVERY, pending=len(self.pending), memory_items=len(self.memory), memory_bytes=self.memory_bytes)
+        if self.disk is not None: stats.update(disk_items=len(self.disk._index), disk_bytes=self.disk.total_bytes(), disk_evictions=self.disk.evictions)
+        return stats
+
+try:
+    speech_store = SpeechStore(SPEECH_TICKET_TTL_SECONDS, SPEECH_STORE_MEMORY_MB * 1024 * 1024, DiskStore(SPEECH_STORE_DIR, SPEECH_STORE_DISK_MB * 1024 * 1024, suffix=".mp3"))
+except OSError as e:
+    logger.warning("Speech disk store unavailable (%s); using memory only", e)
+    speech_store = SpeechStore(SPEECH_TICKET_TTL_SECONDS, SPEECH_STORE_MEMORY_MB * 1024 * 1024)
+
+async def deliver_speech(**synthesis) -> str:
+    """URL the browser can play for this synthesis. In stream mode the clip
+    is rendered when the URL is first fetched; in file mode, right here."""
+    key = speech_store.issue(synthesis) if VOICE_DELIVERY == "stream" else await speech_store.render(synthesis)
+    return f"/speech/{key}.mp3"
+
+def character_voice_synthesis(character_type: str, message: str):
+    """(voice config, ElevenLabs arguments) for a character speaking `message`."""
+    voice_config = CHARACTER_VOICES.get(character_type, CHARACTER_VOICES["turtle"])
+    # Add character personality to message
+    enhanced_message = f"{voice_config['prefix']} {message}"
+    return voice_config, {"voice_id": voice_config["voice_id"], "text": enhanced_message, "model_id": "eleven_multilingual_v2"}
+
+def ambient_synthesis(style: str, character_type: str) -> dict:
+    # Use calm voice for ambient descriptions
+    return {"voice_id": NARRATOR_VOICE_ID, "text": f"Creating ambient {style} atmosphere with {character_type} companion sounds", "model_id": "eleven_multilingual_v2"}
+
+def quote_synthesis(quote: str) -> dict:
+    return {"voice_id": NARRATOR_VOICE_ID, "text": quote, "model_id": "eleven_multilingual_v2"}
+
+def fallback_dialogue(action: str, style: str) -> str:
+    template = FALLBACK_DIALOGUES.get(action)
+    return template.format(style=style) if template else "Let's create something beautiful!"
+
+# --------------------------------------------------------------
+# 1️⃣2️⃣  Asset Warm-up
+# --------------------------------------------------------------
+# Ambient clips, the standard character dialogue lines and the designer
+# quotes are fixed per style/character, so an optional background job
+# renders them into the speech store after startup. It never delays
+# readiness; the first user to pick "Coastal + penguin" gets stored audio
+# instead of a synthesis round trip.
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "false").lower() == "true"
+WARMUP_STYLES = [s.strip() for s in os.getenv("WARMUP_STYLES", "Modern,Minimalist,Coastal").split(",") if s.strip()]
+WARMUP_CHARACTERS = [c.strip() for c in os.getenv("WARMUP_CHARACTERS", "turtle,duck,penguin").split(",") if c.strip()]
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", "2"))
+WARMUP_START_DELAY = float(os.getenv("WARMUP_START_DELAY", "5"))
+
+warmup_state = {"enabled": WARMUP_ENABLED, "status": "idle", "total": 0, "rendered": 0, "cached": 0, "failed": 0, "seconds": None}
+
+def warmup_items() -> list:
+    """Every ElevenLabs request the warm-up should have stored."""
+    items = [ambient_synthesis(style, character) for style in WARMUP_STYLES for character in WARMUP_CHARACTERS]
+    for style in WARMUP_STYLES:
+        for action in FALLBACK_DIALOGUES:
+            items += [character_voice_synthesis(character, fallback_dialogue(action, style))[1] for character in WARMUP_CHARACTERS]
+    items += [quote_synthesis(quote) for quote in DESIGNER_QUOTES]
+    return items
+
+async def warm_up_assets():
+    await asyncio.sleep(WARMUP_START_DELAY)
+    if eleven_client is None:
+        warmup_state["status"] = "skipped (voice feature unavailable)"
+        return
+    items = warmup_items()
+    warmup_state.update(status="running", total=len(items))
+    started = time.perf_counter()
+    limit = asyncio.Semaphore(WARMUP_CONCURRENCY)
+    print(f"🔥 Warming {len(items)} speech clips for {len(WARMUP_STYLES)} styles x {len(WARMUP_CHARACTERS)} characters")
+
+    async def warm(synthesis: dict):
+        async with limit:
+            try:
+                if await speech_store.get(speech_key(synthesis)) is not None:
+                    warmup_state["cached"] += 1
+                    return
+                await speech_store.render(synthesis)
+                warmup_state["rendered"] += 1
+            except Exception as e:
+                warmup_state["failed"] += 1
+                logger.warning("Warm-up clip failed: %s", e)
+
+    await asyncio.gather(*(warm(item) for item in items))
+    warmup_state.update(status="done", seconds=round(time.perf_counter() - started, 1))
+    print(f"✅ Warm-up done: {warmup_state['rendered']} rendered, {warmup_state['cached']} already stored, {warmup_state['failed']} failed")
+
+# --------------------------------------------------------------
+# 1️⃣3️⃣  Upstream Health Prober
+# --------------------------------------------------------------
+# /health is the platform healthcheck, so it must answer instantly even
+# when an optional upstream is slow. A background task probes each
+# configured upstream on an interval and records status and latency;
+# /health serves that snapshot and /ready reports per-upstream freshness.
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "30"))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "5"))
+HEALTH_STALE_AFTER = float(os.getenv("HEALTH_STALE_AFTER", str(3 * HEALTH_PROBE_INTERVAL)))
+READY_REQUIRED_UPSTREAMS = [u.strip() for u in os.getenv("READY_REQUIRED_UPSTREAMS", "").split(",") if u.strip()]
+FAL_HEALTH_URL = os.getenv("FAL_HEALTH_URL", "https://queue.fal.run/")
+ELEVENLABS_HEALTH_URL = os.getenv("ELEVENLABS_HEALTH_URL", "https://api.elevenlabs.io/v1/user")
+
+class HealthProber:
+    """Runs registered probes (async callables returning True when the
+    upstream is usable) every `interval` seconds and keeps the latest result."""
+
+    def __init__(self, interval: float, timeout: float, stale_after: float):
+        self.interval = interval
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.probes = {}
+        self.results = {}
+        self.rounds = 0
+        self.task = None
+
+    def register(self, name: str, probe):
+        self.probes[name] = probe
+
+    def start(self):
+        self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def _loop(self):
+        while True:
+            await self.probe_all()
+            await asyncio.sleep(self.interval)
+
+    async def probe_all(self):
+        await asyncio.gather(*(self._probe(name, probe) for name, probe in self.probes.items()))
+        self.rounds += 1
+
+    async def _probe(self, name: str, probe):
+        started = time.perf_counter()
+        error = None
+        try:
+            ok = bool(await asyncio.wait_for(probe(), self.timeout))
+        except Exception as e:
+            ok, error = False, f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+        previous = self.results.get(name, {})
+        self.results[name] = {
+            "ok": ok,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "checked_at": time.time(),
+            "error": error,
+            "consecutive_failures": 0 if ok else previous.get("consecutive_failures", 0) + 1
+        }
+
+    def status(self, name: str):
+        """True/False from the latest probe, or None if never probed."""
+        result = self.results.get(name)
+        return None if result is None else result["ok"]
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        upstreams = {}
+        for name in self.probes:
+            result = self.results.get(name)
+            if result is None:
+                upstreams[name] = {"ok": None, "fresh": False, "age_s": None}
+                continue
+            age = now - result["checked_at"]
+            upstreams[name] = dict(result, age_s=round(age, 1), fresh=age <= self.stale_after)
+        return upstreams
+
+async def _probe_llm():
+    return (await http_clients["llm"].get("models")).status_code == 200
+
+async def _probe_hf():
+    return (await http_clients["hf"].get("microsoft/DialoGPT-medium")).status_code < 500
+
+async def _probe_elevenlabs():
+    return (await http_clients["default"].get(ELEVENLABS_HEALTH_URL, headers={"xi-api-key": ELEVENLABS_API_KEY})).status_code < 400
+
+async def _probe_fal():
+    return (await http_clients["default"].head(FAL_HEALTH_URL)).status_code < 500
+
+health_prober = HealthProber(HEALTH_PROBE_INTERVAL, HEALTH_PROBE_TIMEOUT, HEALTH_STALE_AFTER)
+if DEPLOYMENT_MODE == "local" or GPT_OSS_API_KEY: health_prober.register("llm", _probe_llm)
+if HF_TOKEN: health_prober.register("huggingface", _probe_hf)
+if eleven_client is not None: health_prober.register("elevenlabs", _probe_elevenlabs)
+if FAL_KEY != "MISSING_KEY": health_prober.register("fal", _probe_fal)
+
+# --------------------------------------------------------------
+# 1️⃣4️⃣  Image Understanding
+# --------------------------------------------------------------
+# Redesign, reconstruction and voiceover all need LLaVA to look at the
+# same room photo. Instead of one vision call per endpoint, each image gets
+# a single rich analysis, memoized per image, and the per-endpoint texts
+# are derived from it: the scene summary directly, the redesign prompt and
+# style voiceover through the (much cheaper) text LLM. Without a text LLM
+# those two fall back to their own LLaVA prompt.
+IMAGE_ANALYSIS_DIR = os.getenv("IMAGE_ANALYSIS_DIR", ".cache/analysis")
+IMAGE_ANALYSIS_TTL_SECONDS = int(os.getenv("IMAGE_ANALYSIS_TTL_SECONDS", str(7 * 24 * 3600)))
+IMAGE_ANALYSIS_PROMPT = (
+    "You are an interior design analyst. Start with one sentence naming the room and its current style, "
+    "then describe the main furniture, the color palette, the materials and textures, and the lighting. About 80 words."
+)
+image_analysis_counters = {"analyses": 0, "derived_by_llm": 0, "vision_fallbacks": 0}
+
+try:
+    image_analysis_cache = ResultCache("image-analysis", 256, DiskStore(IMAGE_ANALYSIS_DIR, 16 * 1024 * 1024, IMAGE_ANALYSIS_TTL_SECONDS, ".json"))
+except OSError as e:
+    logger.warning("Image analysis disk cache unavailable (%s); using memory only", e)
+    image_analysis_cache = ResultCache("image-analysis", 256)
+image_analysis_flight = SingleFlight("image-analysis")
+
+def llava_text(result: dict) -> str:
+    """The generated text from a LLaVA result, whichever shape it came in."""
+    if "output" in result: return result["output"]
+    if "text" in result: return result["text"]
+    if result.get("outputs"): return result["outputs"][0].get("text", "")
+    return ""
+
+def image_analysis_key(image_url: str) -> str:
+    # image_ids and data URLs are keyed by content; a remote URL stands in
+    # for its content (fal CDN URLs are immutable)
+    if is_image_id(image_url): return image_url
+    if image_url.startswith("data:"): return "data_" + content_hash(image_url.encode())[:32]
+    return "url_" + content_hash(image_url.encode())[:32]
+
+async def analyze_image(image_url: str, priority: str = PRIORITY_INTERACTIVE) -> str:
+    """The memoized rich LLaVA description of an image."""
+    key = image_analysis_key(image_url)
+    cached = await image_analysis_cache.get(key)
+    if cached is not None: return cached["analysis"]
+    return await image_analysis_flight.do(key, _run_image_analysis, key, image_url, priority)
+
+async def _run_image_analysis(key: str, image_url: str, priority: str) -> str:
+    result = await run_fal("fal-ai/llava-next", arguments={
+        "image_url": await resolve_image_url(image_url),
+        "prompt": IMAGE_ANALYSIS_PROMPT,
+    }, priority=priority)
+    analysis = llava_text(result).strip()
+    if not analysis: raise Exception(f"Unexpected LLaVA result format: {result}")
+    image_analysis_counters["analyses"] += 1
+    await image_analysis_cache.set(key, {"analysis": analysis})
+    print(f"🔎 Image analysis for {key}: '{analysis[:80]}…'")
+    return analysis
+
+def scene_summary(analysis: str, max_words: int = 15) -> str:
+    """The analysis' opening sentence, clipped to max_words."""
+    first_sentence = re.split(r"(?<=[.!?])\s", analysis.strip(), maxsplit=1)[0]
+    return " ".join(first_sentence.split()[:max_words]).rstrip(".,;:")
+
+def text_llm_available() -> bool:
+    return bool(GPT_OSS_API_KEY) and health_prober.status("llm") is not False
+
+async def derive_from_analysis(analysis: str, instruction: str, max_tokens: int = 120):
+    """Ask the text LLM to answer `instruction` about the room using only
+    the cached analysis. None if the LLM fails; callers then fall back to
+    a dedicated LLaVA call."""
+    try:
+        response = await http_clients["llm"].post(
+            "chat/completions",
+            json={
+                "model": GPT_OSS_MODEL,
+                "messages": [
+                    {"role": "system", "content": "You write about a room photo you cannot see. Rely only on this description of it:\n" + analysis},
+                    {"role": "user", "content": instruction},
+                ],
+                "temperature": 0.4,
+                "max_tokens": max_tokens,
+            },
+            timeout=15.0,
+        )
+        if response.status_code != 200:
+            print(f"LM Studio API error: {response.status_code}")
+            return None
+        text = response.json()["choices"][0]["message"]["content"].strip()
+    except Exception as e:
+        print(f"   - Text LLM unavailable for derived prompt: {e}")
+        return None
+    if text: image_analysis_counters["derived_by_llm"] += 1
+    return text or None
+
+async def describe_image_for(image_url: str, instruction: str, max_tokens: int = 120) -> str:
+    """An endpoint-specific description of an image: derived from the
+    shared analysis when a text LLM is available, else LLaVA answering
+    `instruction` directly (so a missing LLM never costs an extra call)."""
+    if text_llm_available():
+        text = await derive_from_analysis(await analyze_image(image_url), instruction, max_tokens)
+        if text: return text
+    image_analysis_counters["vision_fallbacks"] += 1
+    result = await run_fal("fal-ai/llava-next", arguments={"image_url": await resolve_image_url(image_url), "prompt": instruction})
+    text = llava_text(result)
+    if not text: raise Exception(f"Unexpected LLaVA result format: {result}")
+    return text
+
 # ==============================================================
 # API ROUTES
 # ==============================================================
@@ -182,16 +1564,22 @@ async def root():
         "deployment_mode": DEPLOYMENT_MODE,
         "endpoints": {
             "health": "/health",
+            "ready": "/ready",
+            "metrics": "/metrics",
+            "images": "/images",
             "generate": "/generate-fal-image",
             "redesign": "/redesign-fal-image",
             "reconstruct": "/reconstruct",
-            "chat": "/chat-with-avatar"
+            "reconstruct_jobs": "/reconstruct/jobs",
+            "chat": "/chat-with-avatar",
+            "companion": "/companion/ws"
         }
     }
 
 @app.get("/health")
 async def health_check():
-    """Comprehensive health check showing local-first architecture status"""
+    """Comprehensive health check showing local-first architecture status.
+    Served from the background prober's snapshot; never calls upstreams."""
     health_status = {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
@@ -200,54 +1588,48 @@ async def health_check():
         "models": {}
     }
     
-    # Test FAL AI connection (cloud service)
-    try:
-        # Quick test without actually generating
+    # FAL AI (cloud service)
+    if health_prober.status("fal") is False:
+        health_status["models"]["fal_ai"] = {"status": "⚠️ Unreachable", "type": "cloud", "error": health_prober.results["fal"]["error"]}
+    else:
         health_status["models"]["fal_ai"] = {"status": "✅ Connected", "type": "cloud", "models_available": 7}
-    except Exception as e:
-        health_status["models"]["fal_ai"] = {"status": "❌ Error", "type": "cloud", "error": str(e)}
     
-    # Test Local LM Studio GPT-OSS
+    # Local LM Studio GPT-OSS
     if DEPLOYMENT_MODE == "local":
-        try:
-            # Test local LM Studio connection
-            import httpx
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.get(f"{GPT_OSS_API_URL}/models")
-                if response.status_code == 200:
-                    health_status["models"]["gpt_oss_local"] = {
-                        "status": "✅ LM Studio Running",
-                        "type": "local",
-                        "url": GPT_OSS_API_URL,
-                        "model": GPT_OSS_MODEL,
-                        "role": "Smart Chatbot & Design Intelligence"
-                    }
-                else:
-                    health_status["models"]["gpt_oss_local"] = {
-                        "status": "⚠️ LM Studio Not Running",
-                        "type": "local",
-                        "url": GPT_OSS_API_URL,
-                        "note": "Start LM Studio and load gpt-oss-20b model"
-                    }
-        except Exception as e:
+        lm_status = health_prober.status("llm")
+        if lm_status:
+            health_status["models"]["gpt_oss_local"] = {
+                "status": "✅ LM Studio Running",
+                "type": "local",
+                "url": GPT_OSS_API_URL,
+                "model": GPT_OSS_MODEL,
+                "role": "Smart Chatbot & Design Intelligence"
+            }
+        elif lm_status is None:
+            health_status["models"]["gpt_oss_local"] = {
+                "status": "⏳ Not Probed Yet",
+                "type": "local",
+                "url": GPT_OSS_API_URL
+            }
+        else:
             health_status["models"]["gpt_oss_local"] = {
                 "status": "❌ LM Studio Unreachable",
                 "type": "local",
-                "error": str(e),
-                "solution": "Start LM Studio on localhost:1234"
+                "error": health_prober.results["llm"]["error"],
+                "solution": "Start LM Studio on localhost:1234 and load gpt-oss-20b model"
             }
     else:
         # Cloud mode
         health_status["models"]["gpt_oss_cloud"] = {
-            "status": "✅ Configured" if GPT_OSS_API_KEY else "⚠️ Token Missing",
+            "status": "✅ Configured" if GPT_OSS_API_KEY and health_prober.status("llm") is not False else "⚠️ Token Missing" if not GPT_OSS_API_KEY else "⚠️ Unreachable",
             "type": "cloud",
             "role": "Design Intelligence"
         }
     
-    # Test HuggingFace (optional enhancement)
+    # HuggingFace (optional enhancement)
     if HF_TOKEN:
         health_status["models"]["huggingface"] = {
-            "status": "✅ Cloud Enhancement Active",
+            "status": "⚠️ Unreachable (using local fallbacks)" if health_prober.status("huggingface") is False else "✅ Cloud Enhancement Active",
             "type": "cloud",
             "role": "Enhanced Avatar Generation & Dialogue"
         }
@@ -259,12 +1641,13 @@ async def health_check():
             "note": "Works great without cloud - add HF key for enhanced features"
         }
     
-    # Test ElevenLabs (cloud service)
+    # ElevenLabs (cloud service)
     health_status["models"]["elevenlabs"] = {
-        "status": "✅ Ready" if eleven_client else "⚠️ Not Configured",
+        "status": "⚠️ Not Configured" if not eleven_client else "⚠️ Unreachable" if health_prober.status("elevenlabs") is False else "✅ Ready",
         "type": "cloud",
         "role": "Voice Synthesis"
     }
+    health_status["upstreams"] = health_prober.snapshot()
     
     # Local-first architecture benefits
     local_models = sum(1 for model in health_status["models"].values() if model.get("type") == "local" and "✅" in model["status"])
@@ -292,11 +1675,72 @@ async def health_check():
     
     return health_status
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: the first probe round has finished and every upstream
+    listed in READY_REQUIRED_UPSTREAMS answered recently."""
+    upstreams = health_prober.snapshot()
+    missing = [name for name in READY_REQUIRED_UPSTREAMS if not (upstreams.get(name, {}).get("ok") and upstreams[name]["fresh"])]
+    ready = health_prober.rounds > 0 and not missing
+    body = {"ready": ready, "probe_rounds": health_prober.rounds, "required": READY_REQUIRED_UPSTREAMS, "not_ready": missing, "upstreams": upstreams}
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
+@app.get("/metrics")
+async def metrics():
+    """Counters for the upstream caching and scheduling layers"""
+    return {
+        "fal_cache": fal_cache.stats() if fal_cache else {"enabled": False},
+        "single_flight": {
+            "fal": fal_flight.stats(),
+            "reconstruct": reconstruct_flight.stats(),
+            "reconstruct_jobs_coalesced": reconstruct_jobs.coalesced
+        },
+        "fal_scheduler": fal_scheduler.stats(),
+        "work_avoided": work_avoided,
+        "circuit_breakers": {model: breaker.stats() for model, breaker in circuit_breakers.items()},
+        "reconstruct": dict(reconstruct_counters, checkpoints=reconstruct_checkpoints.stats()),
+        "image_analysis": dict(image_analysis_counters, cache=image_analysis_cache.stats(), single_flight=image_analysis_flight.stats()),
+        "latency": {
+            "segment": dict(segment_latency.summary(), mode=SEGMENT_MODE, hedge_delay_s=round(segment_hedge_delay(), 2)),
+            "recolor": dict(recolor_latency.summary(), workers=RECOLOR_WORKERS),
+            "chat_first_token": chat_ttft.summary(),
+            "chat_total": chat_total.summary(),
+            "voice_first_audio": voice_first_audio.summary()
+        },
+        "companion_sessions": companion_counters,
+        "conversations": conversation_store.stats(),
+        "answer_cache": answer_cache.stats(),
+        "knowledge": dict(design_knowledge.stats(), **knowledge_counters, latency=knowledge_latency.summary()),
+        "speech": speech_store.stats(),
+        "warmup": warmup_state,
+        "mask_store": mask_store.stats(),
+        "image_store": image_store.stats()
+    }
+
+@app.post("/images")
+async def upload_image(file: UploadFile = File(...)):
+    """Store an image once and return an image_id usable as image_url everywhere"""
+    data = await file.read()
+    try:
+        width, height = await run_blocking(lambda: Image.open(io.BytesIO(data)).size)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Uploaded file is not a readable image")
+    image_id = await image_store.put(data)
+    print(f"🖼️ Stored image {image_id} ({len(data) // 1024} KB, {width}x{height})")
+    return {"image_id": image_id, "width": width, "height": height, "bytes": len(data)}
+
+@app.get("/images/{image_id}")
+async def get_image(image_id: str):
+    if not is_image_id(image_id): raise HTTPException(status_code=404, detail="Unknown image id")
+    data = await image_store.require(image_id)
+    fmt = (Image.open(io.BytesIO(data)).format or "PNG").lower()
+    return Response(content=data, media_type=f"image/{fmt}", headers={"Cache-Control": "public, max-age=86400, immutable"})
+
 @app.post("/generate-fal-image")
 async def generate_fal_image(request: ImageGenerateRequest):
     try:
         print(f"🎨 Generating image with prompt: '{request.prompt}'")
-        result = fal_client.run("fal-ai/stable-diffusion-v3-medium", arguments={
+        result = await run_fal("fal-ai/stable-diffusion-v3-medium", arguments={
             "prompt": request.prompt,
             "enable_safety_checker": False,  # Remove safety watermarks
             "num_inference_steps": 50,  # Higher quality
@@ -305,143 +1749,321 @@ async def generate_fal_image(request: ImageGenerateRequest):
         image_url = result["images"][0]["url"]
         print(f"✅ Image generated successfully: {image_url}")
         return {"image_url": image_url}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("❌ Fal.ai image generation error: %s", e)
         raise HTTPException(status_code=500, detail=f"Image generation failed: {str(e)}")
 
 @app.post("/redesign-fal-image")
-async def redesign_fal_image(request: RedesignRequest):
+async def redesign_fal_image(request: RedesignRequest, http_request: Request):
     try:
-        print("🎨 Backend: Starting image redesign workflow…")
-        print("   - Generating text prompt from image...")
-        llava_result = fal_client.run("fal-ai/llava-next", arguments={ "image_url": request.image_url, "prompt": request.prompt })
-        print("🔍 LLaVA raw result:", llava_result)
-        redesign_prompt = ""
-        if "output" in llava_result: redesign_prompt = llava_result["output"]
-        elif "text" in llava_result: redesign_prompt = llava_result["text"]
-        elif "outputs" in llava_result and len(llava_result["outputs"]) > 0: redesign_prompt = llava_result["outputs"][0].get("text", "")
-        if not redesign_prompt: raise Exception(f"Unexpected LLaVA result format: {llava_result}")
-        print(f"   - Generated Redesign Prompt: '{redesign_prompt}'")
-        print("   - Generating new image from prompt...")
-        image_result = fal_client.run("fal-ai/stable-diffusion-v3-medium", arguments={ "prompt": redesign_prompt })
-        image_url = image_result["images"][0]["url"]
-        print(f"✅ Redesign image generated successfully: {image_url}")
-        return {"image_url": image_url}
+        return await run_until_disconnect(http_request, run_redesign(request.image_url, request.prompt))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("❌ Fal.ai redesign workflow error: %s", e)
         raise HTTPException(status_code=500, detail=f"Image redesign failed: {str(e)}")
 
+async def run_redesign(image_url: str, prompt: str) -> dict:
+    """The image is described per `prompt` (from the shared image analysis
+    when possible), SD3 renders the description, within
+    REDESIGN_DEADLINE_SECONDS."""
+    deadline = Deadline(REDESIGN_DEADLINE_SECONDS, REDESIGN_STAGE_WEIGHTS)
+    print("🎨 Backend: Starting image redesign workflow…")
+    print("   - Generating text prompt from image...")
+    redesign_prompt = await deadline.run("describe", describe_image_for(image_url, prompt, max_tokens=80))
+    print(f"   - Generated Redesign Prompt: '{redesign_prompt}'")
+    print("   - Generating new image from prompt...")
+    image_result = await deadline.run("generate", run_fal("fal-ai/stable-diffusion-v3-medium", arguments={ "prompt": redesign_prompt }))
+    image_url = image_result["images"][0]["url"]
+    print(f"✅ Redesign image generated successfully: {image_url}")
+    return {"image_url": image_url}
+
 # ✅ UPDATED: The /segment endpoint with comprehensive debugging and fallback strategies
-@app.post("/segment")
-async def segment_image(request: SegmentRequest):
+# SAM2 prompt strategies in priority order: (response name, log label, arguments)
+SAM2_MODEL = "fal-ai/sam2/image"
+SEGMENT_STRATEGIES = [
+    # Strategy 1: Room-optimized segmentation with furniture focus
+    ("center_point", "Room furniture detection", {
+        "prompts": [
+            {"type": "point", "data": {"x": 0.3, "y": 0.6}, "label": 1},  # Typical furniture location
+            {"type": "point", "data": {"x": 0.7, "y": 0.6}, "label": 1},  # Another furniture spot
+            {"type": "point", "data": {"x": 0.5, "y": 0.4}, "label": 1}   # Center furniture
+        ],
+        "multimask_output": True,
+        "pred_iou_thresh": 0.7,  # Lower threshold for room objects
+        "stability_score_thresh": 0.8
+    }),
+    # Strategy 2: Multiple grid points
+    ("grid_points", "Grid points", {
+        "prompts": [
+            {"type": "point", "data": {"x": 0.2, "y": 0.2}, "label": 1},
+            {"type": "point", "data": {"x": 0.5, "y": 0.2}, "label": 1},
+            {"type": "point", "data": {"x": 0.8, "y": 0.2}, "label": 1},
+            {"type": "point", "data": {"x": 0.2, "y": 0.5}, "label": 1},
+            {"type": "point", "data": {"x": 0.8, "y": 0.5}, "label": 1},
+            {"type": "point", "data": {"x": 0.2, "y": 0.8}, "label": 1},
+            {"type": "point", "data": {"x": 0.5, "y": 0.8}, "label": 1},
+            {"type": "point", "data": {"x": 0.8, "y": 0.8}, "label": 1}
+        ],
+        "multimask_output": True
+    }),
+    # Strategy 3: Box prompt covering most of the image
+    ("box_prompt", "Box prompt", {
+        "box_prompts": [{"x1": 0.1, "y1": 0.1, "x2": 0.9, "y2": 0.9}],
+        "multimask_output": True
+    }),
+]
+# "hedged" starts each fallback strategy once the previous one has run for
+# SEGMENT_HEDGE_DELAY seconds; "sequential" is the original cascade. Every
+# launched strategy is billed, so by default the delay is strategy 1's
+# median latency (a hedge then fires only for the slow half of calls, and
+# never below a second); a number fixes it, and 0 races all three at once.
+SEGMENT_MODE = os.getenv("SEGMENT_MODE", "hedged")
+SEGMENT_HEDGE_DELAY = os.getenv("SEGMENT_HEDGE_DELAY", "auto")
+SEGMENT_HEDGE_INITIAL_DELAY = 4.0  # until strategy 1 has latency samples
+segment_latency = LatencyTracker()
+segment_primary_latency = LatencyTracker(window=200)
+
+def segment_hedge_delay() -> float:
+    if SEGMENT_HEDGE_DELAY != "auto": return float(SEGMENT_HEDGE_DELAY)
+    return max(1.0, segment_primary_latency.percentile(0.5, SEGMENT_HEDGE_INITIAL_DELAY))
+
+MASK_STORE_MAX_MB = int(os.getenv("MASK_STORE_MAX_MB", "64"))
+
+class MaskStore:
+    """Server-side store of decoded SAM2 masks, bit-packed with NumPy
+    (1 bit per pixel) and evicted LRU once over its byte budget. Masks are
+    addressed by a short content-derived id."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.masks = OrderedDict()  # mask_id -> (packed bits, (height, width))
+        self.total_bytes = 0
+        self.evictions = 0
+
+    def put(self, mask: np.ndarray) -> str:
+        packed = np.packbits(mask.astype(bool), axis=None)
+        mask_id = content_hash(packed.tobytes() + f"{mask.shape}".encode())[:16]
+        if mask_id not in self.masks:
+            self.masks[mask_id] = (packed, mask.shape)
+            self.total_bytes += packed.nbytes
+        self.masks.move_to_end(mask_id)
+        while self.total_bytes > self.max_bytes and len(self.masks) > 1:
+            _, (evicted, _) = self.masks.popitem(last=False)
+            self.total_bytes -= evicted.nbytes
+            self.evictions += 1
+        return mask_id
+
+    def get_packed(self, mask_id: str):
+        """Return (packed bits, shape) without unpacking, or None."""
+        entry = self.masks.get(mask_id)
+        if entry is not None: self.masks.move_to_end(mask_id)
+        return entry
+
+    def get(self, mask_id: str):
+        """Return the mask as a boolean (height, width) array, or None."""
+        entry = self.masks.get(mask_id)
+        if entry is None: return None
+        self.masks.move_to_end(mask_id)
+        packed, shape = entry
+        return np.unpackbits(packed, count=shape[0] * shape[1]).reshape(shape).astype(bool)
+
+    def stats(self) -> dict:
+        return {"masks": len(self.masks), "bytes": self.total_bytes, "evictions": self.evictions}
+
+mask_store = MaskStore(MASK_STORE_MAX_MB * 1024 * 1024)
+
+def decode_mask_image(data: bytes) -> np.ndarray:
+    return np.asarray(Image.open(io.BytesIO(data)).convert("L")) > 127
+
+def mask_to_png(mask: np.ndarray) -> bytes:
+    buf = io.BytesIO()
+    Image.fromarray(mask.astype(np.uint8) * 255, mode="L").save(buf, format="PNG")
+    return buf.getvalue()
+
+async def fetch_mask_bytes(mask) -> bytes:
+    """Raw PNG bytes for a SAM2 mask entry (data URL, remote URL or dict)."""
+    source = mask.get("mask") or mask.get("url") if isinstance(mask, dict) else mask
+    if not isinstance(source, str) or not source: raise ValueError("Mask entry has no image")
+    if source.startswith("data:"):
+        return base64.b64decode(source.split(",", 1)[1])
+    response = await http_clients["default"].get(source, timeout=30.0)
+    response.raise_for_status()
+    return response.content
+
+async def store_mask(mask, inline: bool) -> dict:
+    """Decode a SAM2 mask once, keep it in mask_store and describe it by handle."""
+    entry = dict(mask) if isinstance(mask, dict) else {"mask": mask}
     try:
-        print("🔍 Backend: Starting image segmentation…")
-        print(f"   Image URL: {request.image_url}")
-        
-        # Strategy 1: Room-optimized segmentation with furniture focus
-        try:
-            print("   Trying Strategy 1: Room furniture detection...")
-            result = fal_client.run("fal-ai/sam2/image", arguments={
-                "image_url": request.image_url,
-                "prompts": [
-                    {"type": "point", "data": {"x": 0.3, "y": 0.6}, "label": 1},  # Typical furniture location
-                    {"type": "point", "data": {"x": 0.7, "y": 0.6}, "label": 1},  # Another furniture spot
-                    {"type": "point", "data": {"x": 0.5, "y": 0.4}, "label": 1}   # Center furniture
-                ],
-                "multimask_output": True,
-                "pred_iou_thresh": 0.7,  # Lower threshold for room objects
-                "stability_score_thresh": 0.8
-            })
-            
-            print(f"   SAM2 raw result: {result}")
-            
-            # Check different possible response formats
-            masks = result.get('masks', [])
-            if not masks and 'outputs' in result:
-                masks = result['outputs']
-            if not masks and 'segmentation_masks' in result:
-                masks = result['segmentation_masks']
-            
-            if masks and len(masks) > 0:
-                print(f"✅ Strategy 1 success: {len(masks)} masks found")
-                return {"masks": masks, "strategy": "center_point"}
-                
-        except Exception as sam_error:
-            print(f"   Strategy 1 failed: {sam_error}")
-        
-        # Strategy 2: Multiple grid points
-        try:
-            print("   Trying Strategy 2: Grid points...")
-            result = fal_client.run("fal-ai/sam2/image", arguments={
-                "image_url": request.image_url,
-                "prompts": [
-                    {"type": "point", "data": {"x": 0.2, "y": 0.2}, "label": 1},
-                    {"type": "point", "data": {"x": 0.5, "y": 0.2}, "label": 1},
-                    {"type": "point", "data": {"x": 0.8, "y": 0.2}, "label": 1},
-                    {"type": "point", "data": {"x": 0.2, "y": 0.5}, "label": 1},
-                    {"type": "point", "data": {"x": 0.8, "y": 0.5}, "label": 1},
-                    {"type": "point", "data": {"x": 0.2, "y": 0.8}, "label": 1},
-                    {"type": "point", "data": {"x": 0.5, "y": 0.8}, "label": 1},
-                    {"type": "point", "data": {"x": 0.8, "y": 0.8}, "label": 1}
-                ],
-                "multimask_output": True
-            })
-            
-            masks = result.get('masks', [])
-            if not masks and 'outputs' in result:
-                masks = result['outputs']
-            
-            if masks and len(masks) > 0:
-                print(f"✅ Strategy 2 success: {len(masks)} masks found")
-                return {"masks": masks, "strategy": "grid_points"}
-                
-        except Exception as grid_error:
-            print(f"   Strategy 2 failed: {grid_error}")
-        
-        # Strategy 3: Box prompt covering most of the image
-        try:
-            print("   Trying Strategy 3: Box prompt...")
-            result = fal_client.run("fal-ai/sam2/image", arguments={
-                "image_url": request.image_url,
-                "box_prompts": [{"x1": 0.1, "y1": 0.1, "x2": 0.9, "y2": 0.9}],
-                "multimask_output": True
-            })
-            
-            masks = result.get('masks', [])
-            if masks and len(masks) > 0:
-                print(f"✅ Strategy 3 success: {len(masks)} masks found")
-                return {"masks": masks, "strategy": "box_prompt"}
-                
-        except Exception as box_error:
-            print(f"   Strategy 3 failed: {box_error}")
+        decoded = await run_blocking(decode_mask_image, await fetch_mask_bytes(mask))
+    except Exception as decode_error:
+        print(f"   ⚠️ Could not decode mask for the mask store: {decode_error}")
+        return entry
+    mask_id = mask_store.put(decoded)
+    entry.update(mask_id=mask_id, mask_url=f"/masks/{mask_id}.png", width=decoded.shape[1], height=decoded.shape[0], area=int(decoded.sum()))
+    if not inline:
+        entry.pop("mask", None)
+        entry.pop("url", None)
+    return entry
+
+async def run_segment_strategy(index: int, image_url: str) -> list:
+    """Run one SAM2 strategy and return its masks (empty on failure)."""
+    name, label, arguments = SEGMENT_STRATEGIES[index]
+    try:
+        print(f"   Trying Strategy {index + 1}: {label}...")
+        started = time.perf_counter()
+        result = await run_fal(SAM2_MODEL, arguments={"image_url": image_url, **arguments})
+        if index == 0: segment_primary_latency.record(time.perf_counter() - started)
+        print(f"   SAM2 raw result ({name}): {result}")
+        # Check different possible response formats
+        masks = result.get('masks', [])
+        if not masks and 'outputs' in result:
+            masks = result['outputs']
+        if not masks and 'segmentation_masks' in result:
+            masks = result['segmentation_masks']
+        if masks:
+            print(f"✅ Strategy {index + 1} success: {len(masks)} masks found")
+        return masks or []
+    except HTTPException:
+        raise
+    except Exception as sam_error:
+        print(f"   Strategy {index + 1} failed: {sam_error}")
+        return []
+
+async def segment_sequential(image_url: str) -> tuple:
+    for index, (name, _, _) in enumerate(SEGMENT_STRATEGIES):
+        masks = await run_segment_strategy(index, image_url)
+        if masks: return masks, name
+    return [], "none"
+
+async def segment_hedged(image_url: str, hedge_delay: float) -> tuple:
+    """Launch strategies concurrently (staggered by hedge_delay) but accept
+    results strictly in priority order; the rest are cancelled as soon as
+    a higher-priority strategy succeeds."""
+    tasks = []
+    launch = lambda: tasks.append(asyncio.create_task(run_segment_strategy(len(tasks), image_url)))
+    try:
+        for index, (name, _, _) in enumerate(SEGMENT_STRATEGIES):
+            if index >= len(tasks): launch()
+            while not tasks[index].done():
+                if len(tasks) == len(SEGMENT_STRATEGIES):
+                    await asyncio.wait({tasks[index]})
+                else:
+                    done, _ = await asyncio.wait({tasks[index]}, timeout=hedge_delay)
+                    if not done: launch()
+            masks = tasks[index].result()
+            if masks: return masks, name
+        return [], "none"
+    finally:
+        for task in tasks:
+            if not task.done(): task.cancel()
+
+@app.post("/segment")
+async def segment_image(request: SegmentRequest):
+    try:
+        print("🔍 Backend: Starting image segmentation…")
+        print(f"   Image URL: {request.image_url[:100]}")
+        started = time.perf_counter()
+        if not circuit_breaker(SAM2_MODEL).available():
+            print("⚠️ SAM2 circuit open, skipping segmentation strategies")
+            return {"masks": [], "strategy": "none", "message": "Segmentation is temporarily unavailable, please try again shortly"}
+        image_url = await resolve_image_url(request.image_url)
+
+        if SEGMENT_MODE == "sequential":
+            masks, strategy = await segment_sequential(image_url)
+        else:
+            masks, strategy = await segment_hedged(image_url, segment_hedge_delay())
+        segment_latency.record(time.perf_counter() - started)
+
+        if masks:
+            masks = await asyncio.gather(*(store_mask(mask, request.inline_masks) for mask in masks))
+            return {"masks": masks, "strategy": strategy}
         
         # If all strategies fail, return empty but valid response
         print("⚠️ All segmentation strategies failed, returning empty masks")
         return {"masks": [], "strategy": "none", "message": "No objects detected in image"}
         
+    except HTTPException:
+        raise
     except Exception as exc:
         logger.exception("❌ Backend segmentation error: %s", exc)
         raise HTTPException(status_code=500, detail=f"Segmentation failed: {exc}")
 
+@app.get("/masks/{mask_id}.png")
+async def get_mask_image(mask_id: str):
+    """Render a stored mask as a PNG (for overlays that only hold a handle)"""
+    mask = mask_store.get(mask_id)
+    if mask is None: raise HTTPException(status_code=404, detail="Unknown or expired mask id")
+    png = await run_blocking(mask_to_png, mask)
+    return Response(content=png, media_type="image/png", headers={"Cache-Control": "public, max-age=86400, immutable"})
+
+RECOLOR_WORKERS = int(os.getenv("RECOLOR_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Decode + recolor + JPEG encode is CPU-bound, so it runs in worker
+# processes (RECOLOR_WORKERS=0 keeps it on the upstream thread pool).
+# Workers are spawned, not forked: they start lazily mid-request, and forking
+# a process that runs the event loop and thread pools can deadlock.
+recolor_executor = ProcessPoolExecutor(max_workers=RECOLOR_WORKERS, mp_context=multiprocessing.get_context("spawn")) if RECOLOR_WORKERS > 0 else None
+recolor_latency = LatencyTracker()
+
+def mask_layer_spec(mask: dict) -> dict:
+    """Recolor-engine mask spec for a request mask: a stored handle is sent
+    still bit-packed, otherwise the PNG bytes of the data URL."""
+    mask_id = mask.get("mask_id")
+    packed = mask_store.get_packed(mask_id) if mask_id else None
+    if packed is not None:
+        return {"packed": packed[0], "shape": packed[1]}
+    mask_b64 = mask.get("mask", "")
+    if mask_id and not mask_b64:
+        raise HTTPException(status_code=404, detail="Unknown or expired mask id, please segment again")
+    if not mask_b64: raise ValueError("Mask payload is empty")
+    if mask_b64.startswith("data:image"): mask_b64 = mask_b64.split(",", 1)[1]
+    return {"png": base64.b64decode(mask_b64)}
+
+async def run_recolor(image_url: str, layers: list, mode: str) -> dict:
+    """Recolor an image with several (mask, color) pairs in one pass."""
+    if mode not in ("shade", "flat"): raise HTTPException(status_code=400, detail="mode must be 'shade' or 'flat'")
+    specs = [(mask_layer_spec(mask), tuple(color)) for mask, color in layers]
+    image_bytes = await load_image_bytes(image_url)
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    jpeg = await loop.run_in_executor(recolor_executor or upstream_executor, recolor_image, image_bytes, specs, mode)
+    recolor_latency.record(time.perf_counter() - started)
+    if is_image_id(image_url):
+        # Store the result too so the next edit can reference it by id; the
+        # client loads the pixels from /images/<id> instead of a data URL
+        image_id = await image_store.put(jpeg)
+        return {"image_id": image_id, "image_url": f"/images/{image_id}"}
+    return {"image_url": f"data:image/jpeg;base64,{base64.b64encode(jpeg).decode()}"}
+
 @app.post("/recolor")
 async def recolor_object(request: RecolorRequest):
+    if is_image_id(request.image_url): await image_store.require(request.image_url)
     try:
         print("🎨 Backend: Starting recolor...")
-        img = base64_to_image(request.image_url)
-        mask_b64 = request.mask.get("mask", "")
-        if not mask_b64: raise ValueError("Mask payload is empty")
-        if mask_b64.startswith("data:image"): mask_b64 = mask_b64.split(",", 1)[1]
-        mask_bytes = base64.b64decode(mask_b64)
-        mask_img = Image.open(io.BytesIO(mask_bytes)).convert("L")
-        colour = tuple(request.color)
-        overlay = Image.new("RGB", img.size, colour)
-        recoloured = Image.composite(overlay, img, mask_img)
-        recoloured_b64 = image_to_base64(recoloured, fmt="JPEG")
-        return {"image_url": f"data:image/jpeg;base64,{recoloured_b64}"}
+        return await run_recolor(request.image_url, [(request.mask, request.color)], request.mode)
+    except HTTPException:
+        raise
     except Exception as exc:
         logger.exception("❌ Recolor error: %s", exc)
+        if is_image_id(request.image_url): return {"image_id": request.image_url, "image_url": f"/images/{request.image_url}"}
         return {"image_url": request.image_url}
 
+@app.post("/recolor-batch")
+async def recolor_objects(request: RecolorBatchRequest):
+    """Recolor several objects (e.g. sofa, walls and rug) in one round trip"""
+    if not request.layers: raise HTTPException(status_code=400, detail="At least one layer is required")
+    if is_image_id(request.image_url): await image_store.require(request.image_url)
+    try:
+        print(f"🎨 Backend: Starting batch recolor of {len(request.layers)} objects...")
+        return await run_recolor(request.image_url, [(layer.mask, layer.color) for layer in request.layers], request.mode)
+    except HTTPException:
+        raise
+    except Exception as exc:
+        logger.exception("❌ Batch recolor error: %s", exc)
+        raise HTTPException(status_code=500, detail=f"Batch recolor failed: {exc}")
+
 # In backend/main.py
 
 # In backend/main.py
@@ -460,142 +2082,333 @@ async def recolor_object(request: RecolorRequest):
 # In backend/main.py
 # (Ensure `import numpy as np` is at the top of your file)
 
-@app.post("/reconstruct")
-async def reconstruct_3d(request: ReconstructRequest):
+RECONSTRUCT_NUM_VIEWS = 36
+RECONSTRUCT_VIEW_CONCURRENCY = int(os.getenv("RECONSTRUCT_VIEW_CONCURRENCY", "6"))
+RECONSTRUCT_VIEW_TIMEOUT = float(os.getenv("RECONSTRUCT_VIEW_TIMEOUT", "180"))
+
+async def generate_views(scene_description: str, num_views: int, progress=None, budget: float = None, done: dict = None, on_view=None) -> tuple:
+    """Generate the extra camera views concurrently, at most
+    RECONSTRUCT_VIEW_CONCURRENCY at a time. Returns (urls, summed_view_seconds);
+    urls keep angle order and failed or timed-out views are skipped. Views
+    still running when `budget` seconds have passed are cancelled. Views
+    already in `done` ({str(index): url}, from a checkpoint) are reused,
+    and `await on_view(index, url)` is called as each new one finishes."""
+    semaphore = asyncio.Semaphore(RECONSTRUCT_VIEW_CONCURRENCY)
+    view_latencies = []
+    done = done or {}
+    completed = len(done)
+
+    async def generate_view(i: int):
+        nonlocal completed
+        angle = (i / (num_views - 1)) * 360
+        elevation = 15 + 15 * np.sin(np.radians(angle * 2))
+        view_prompt = f"{scene_description}, photorealistic, UHD, 8k, cinematic, view from a {int(angle)} degree angle, {int(elevation)} degree elevation."
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                view_result = await run_fal("fal-ai/stable-diffusion-v3-medium", arguments={"prompt": view_prompt}, timeout=RECONSTRUCT_VIEW_TIMEOUT, priority=PRIORITY_BATCH)
+                completed += 1
+                if completed % 6 == 0: print(f"     - Generated view {completed}/{num_views}")
+                if progress: progress("2/4", "Generated camera view", views_done=completed, views_total=num_views - 1)
+                url = view_result["images"][0]["url"]
+                if on_view: await on_view(i, url)
+                return url
+            except Exception as view_error:
+                print(f"     - Failed to generate view {i+1}/{num_views}: {view_error!r}")
+                return None
+            finally:
+                view_latencies.append(time.perf_counter() - started)
+
+    tasks = {i: asyncio.ensure_future(generate_view(i)) for i in range(num_views - 1) if str(i) not in done}
     try:
-        print("🪐 Backend: Starting EXCELLENCE Tier 3D Reconstruction Pipeline…")
-        
-        # --- Stage 1/4: Input Image Upscaling ---
+        if tasks:
+            _, pending = await asyncio.wait(tasks.values(), timeout=budget)
+            if pending:
+                work_avoided["views_cancelled"] += len(pending)
+                print(f"     - View budget of {budget:.0f}s used up; cancelling {len(pending)} unfinished views")
+    finally:
+        for task in tasks.values(): task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+    urls = []
+    for i in range(num_views - 1):
+        if str(i) in done: urls.append(done[str(i)])
+        elif not tasks[i].cancelled() and tasks[i].result(): urls.append(tasks[i].result())
+    return urls, sum(view_latencies)
+
+RECONSTRUCT_FALLBACK_RESULT = {
+    "reconstruction_url": "https://modelviewer.dev/shared-assets/models/Astronaut.glb", 
+    "model_info": {
+        "model_used": "fallback-astronaut",
+        "note": "3D reconstruction service temporarily unavailable"
+    }
+}
+
+reconstruct_flight = SingleFlight("reconstruct")
+INSTANT_MESH_MODEL = "fal-ai/instant-mesh"
+reconstruct_counters = {"views_skipped": 0, "resumed_runs": 0, "stages_resumed": 0, "views_reused": 0}
+
+# Stage checkpoints: the upscaled image URL, scene description and every
+# generated view URL are saved under the pipeline key of the input image
+# as they complete, so a retried or resubmitted reconstruction resumes
+# from the last completed stage instead of paying for them again.
+RECONSTRUCT_CHECKPOINT_DIR = os.getenv("RECONSTRUCT_CHECKPOINT_DIR", ".cache/checkpoints")
+RECONSTRUCT_CHECKPOINT_TTL_SECONDS = int(os.getenv("RECONSTRUCT_CHECKPOINT_TTL_SECONDS", str(24 * 3600)))
+
+try:
+    reconstruct_checkpoints = ResultCache("reconstruct-checkpoints", 64, DiskStore(RECONSTRUCT_CHECKPOINT_DIR, 64 * 1024 * 1024, RECONSTRUCT_CHECKPOINT_TTL_SECONDS, ".json"))
+except OSError as e:
+    logger.warning("Reconstruction checkpoint disk store unavailable (%s); using memory only", e)
+    reconstruct_checkpoints = ResultCache("reconstruct-checkpoints", 64)
+
+def reconstruction_key(image_url: str) -> str:
+    return cache_key("reconstruct", {"image_url": image_url})
+
+def _no_progress(stage: str, message: str, **details):
+    pass
+
+async def run_reconstruction(image_url: str, progress=_no_progress, deadline: Deadline = None) -> dict:
+    """The full upscale → LLaVA → views → mesh pipeline within a time budget
+    (RECONSTRUCT_DEADLINE_SECONDS by default). Calls progress(stage,
+    message, **details) at each milestone and raises if no mesh could be
+    produced in time."""
+    deadline = deadline or Deadline(RECONSTRUCT_DEADLINE_SECONDS, RECONSTRUCT_STAGE_WEIGHTS)
+    try:
+        return await reconstruction_stages(image_url, progress, deadline)
+    except (asyncio.CancelledError, DeadlineExceeded):
+        # Stages that never started are upstream work we didn't pay for
+        skipped = [stage for stage in deadline.weights if stage != "trellis"]
+        work_avoided["stages_skipped"] += len(skipped)
+        if skipped: print(f"   🛑 Reconstruction stopped early; skipped stages: {', '.join(skipped)}")
+        raise
+
+async def reconstruction_stages(image_url: str, progress, deadline: Deadline) -> dict:
+    print("🪐 Backend: Starting EXCELLENCE Tier 3D Reconstruction Pipeline…")
+    stage_timings = {}
+    checkpoint_key = reconstruction_key(image_url)
+    checkpoint = await reconstruct_checkpoints.get(checkpoint_key) or {}
+    checkpoint.setdefault("views", {})
+    resumed = [stage for stage in ("upscaled_url", "scene_description") if stage in checkpoint]
+    if checkpoint["views"]: resumed.append(f"{len(checkpoint['views'])} views")
+    if resumed:
+        reconstruct_counters["resumed_runs"] += 1
+        print(f"   ♻️ Resuming from checkpoint: {', '.join(resumed)}")
+
+    # Views finish concurrently; one write at a time, each snapshotting the
+    # checkpoint when it starts, so an older snapshot never lands on disk
+    # after a newer one
+    checkpoint_lock = asyncio.Lock()
+
+    async def save_checkpoint(**stage_outputs):
+        checkpoint.update(stage_outputs)
+        async with checkpoint_lock:
+            await reconstruct_checkpoints.set(checkpoint_key, checkpoint)
+
+    async def save_view(index: int, url: str):
+        checkpoint["views"][str(index)] = url
+        async with checkpoint_lock:
+            await reconstruct_checkpoints.set(checkpoint_key, checkpoint)
+
+    # --- Stage 1/4: Input Image Upscaling ---
+    stage_started = time.perf_counter()
+    if "upscaled_url" in checkpoint:
+        deadline.skip("upscale")
+        reconstruct_counters["stages_resumed"] += 1
+        high_res_image_url = checkpoint["upscaled_url"]
+        print("   Stage 1/4: Resumed - reusing upscaled image from checkpoint.")
+        progress("1/4", "Reusing upscaled image from a previous run")
+    else:
         print("   Stage 1/4: Upscaling input image to 4K for maximum detail...")
-        base_image_url = request.image_url
+        progress("1/4", "Upscaling input image to 4K")
+        base_image_url = await resolve_image_url(image_url)
         try:
-            upscale_result = fal_client.run("fal-ai/real-esrgan", arguments={
+            upscale_result = await deadline.run("upscale", run_fal("fal-ai/real-esrgan", arguments={
                 "image_url": base_image_url,
                 "scale": 4,
-            })
+            }, priority=PRIORITY_BATCH))
             high_res_image_url = upscale_result["image"]["url"]
+            await save_checkpoint(upscaled_url=high_res_image_url)
             print(f"   ✅ Stage 1/4 complete. Image upscaled to 4K.")
         except Exception as upscale_error:
+            # Not checkpointed, so a retry gets another shot at the upscale
             print(f"   ⚠️ Stage 1/4 failed: {upscale_error}. Proceeding with original resolution.")
             high_res_image_url = base_image_url
+    stage_timings["upscale"] = round(time.perf_counter() - stage_started, 2)
 
-        # --- Stage 2/4: AI Scene Analysis & Mass View Generation ---
+    # --- Stage 2/4: AI Scene Analysis & Mass View Generation ---
+    image_urls = [high_res_image_url] # Start with the upscaled original
+    # The extra views only feed InstantMesh; skip them while its breaker is open
+    multi_view = circuit_breaker(INSTANT_MESH_MODEL).available()
+    if multi_view:
         print("   Stage 2/4: Analyzing scene and generating 36 camera angles...")
-        image_urls = [high_res_image_url] # Start with the upscaled original
-        
-        scene_desc_result = fal_client.run("fal-ai/llava-next", arguments={
-            "image_url": high_res_image_url,
-            "prompt": "You are a professional photographer. In 15 words, describe the main subject and style of this interior design photo."
-        })
-        scene_description = scene_desc_result["output"]
-        print(f"   - Scene Description: '{scene_description}'")
+        progress("2/4", "Analyzing scene and generating camera angles")
+        stage_started = time.perf_counter()
 
-        num_views = 36
-        for i in range(num_views - 1):
-            angle = (i / (num_views - 1)) * 360
-            elevation = 15 + 15 * np.sin(np.radians(angle * 2))
-            try:
-                view_prompt = f"{scene_description}, photorealistic, UHD, 8k, cinematic, view from a {int(angle)} degree angle, {int(elevation)} degree elevation."
-                view_result = fal_client.run("fal-ai/stable-diffusion-v3-medium", arguments={"prompt": view_prompt})
-                image_urls.append(view_result["images"][0]["url"])
-                if (i + 1) % 6 == 0: print(f"     - Generated view {i+1}/{num_views}")
-            except Exception as view_error:
-                print(f"     - Failed to generate view {i+1}/{num_views}")
-        
+        if "scene_description" in checkpoint:
+            deadline.skip("scene_description")
+            reconstruct_counters["stages_resumed"] += 1
+            scene_description = checkpoint["scene_description"]
+            print(f"   - Scene Description (from checkpoint): '{scene_description}'")
+        else:
+            # The analysis is shared with redesign and voiceover for the same photo
+            analysis = await deadline.run("scene_description", analyze_image(image_url, priority=PRIORITY_BATCH))
+            scene_description = scene_summary(analysis)
+            await save_checkpoint(scene_description=scene_description)
+            print(f"   - Scene Description: '{scene_description}'")
+        stage_timings["scene_description"] = round(time.perf_counter() - stage_started, 2)
+        stage_started = time.perf_counter()
+
+        reused_views = dict(checkpoint["views"])
+        if reused_views:
+            reconstruct_counters["views_reused"] += len(reused_views)
+            print(f"   - Reusing {len(reused_views)} camera views from checkpoint")
+        view_urls, view_seconds = await generate_views(scene_description, RECONSTRUCT_NUM_VIEWS, progress, budget=deadline.budget("views"), done=reused_views, on_view=save_view)
+        image_urls.extend(view_urls)
+        stage_timings["views"] = round(time.perf_counter() - stage_started, 2)
+        print(f"   - View fan-out: {stage_timings['views']:.1f}s wall vs {view_seconds:.1f}s summed view latency")
         print(f"   ✅ Stage 2/4 complete. Total views for reconstruction: {len(image_urls)}")
+    else:
+        deadline.skip("scene_description", "views", "instant_mesh")
+        reconstruct_counters["views_skipped"] += 1
+        print("   Stage 2/4: Skipped - InstantMesh circuit open, going straight to single-view Trellis.")
+        progress("2/4", "Skipping multi-view generation (InstantMesh unavailable)")
+
+    # --- Stage 3/4: The Waterfall Reconstruction ---
+    print("   Stage 3/4: Attempting reconstruction with the best available models...")
+    progress("3/4", "Reconstructing 3D mesh", views=len(image_urls))
+    stage_started = time.perf_counter()
+    final_result = None
+    model_used = ""
 
-        # --- Stage 3/4: The Waterfall Reconstruction ---
-        print("   Stage 3/4: Attempting reconstruction with the best available models...")
-        final_result = None
-        model_used = ""
+    # Attempt 1: InstantMesh (Best for Multi-View)
+    try:
+        if not multi_view: raise CircuitOpenError(f"{INSTANT_MESH_MODEL} is failing; circuit open")
+        print("      - Attempting: fal-ai/instant-mesh (Multi-View ULTRA)")
+        result = await deadline.run("instant_mesh", run_fal(INSTANT_MESH_MODEL, arguments={
+            "image_urls": image_urls,
+            "texture_resolution": 4096,
+            "mesh_simplification": 1.0,
+            "multiview_consistent": True,
+        }, priority=PRIORITY_BATCH))
+        final_result = result
+        model_used = "fal-ai/instant-mesh (36-View)"
+        print(f"      ✅ InstantMesh Succeeded!")
+    except Exception as e:
+        print(f"      - Instant-Mesh failed: {e}")
 
-        # Attempt 1: InstantMesh (Best for Multi-View)
+    # Attempt 2: Trellis (Best for Single-View)
+    if not final_result:
         try:
-            print("      - Attempting: fal-ai/instant-mesh (Multi-View ULTRA)")
-            result = fal_client.run("fal-ai/instant-mesh", arguments={
-                "image_urls": image_urls,
-                "texture_resolution": 4096,
-                "mesh_simplification": 1.0,
-                "multiview_consistent": True,
-            })
+            print("      - Attempting: fal-ai/trellis (Single-View ULTRA-HQ)")
+            result = await deadline.run("trellis", run_fal("fal-ai/trellis", arguments={
+                "image_url": high_res_image_url, # Use the best single image
+                "do_remove_background": True,
+                "texture_resolution": 2048,
+                "target_polycount": 150000,
+            }, priority=PRIORITY_BATCH))
             final_result = result
-            model_used = "fal-ai/instant-mesh (36-View)"
-            print(f"      ✅ InstantMesh Succeeded!")
+            model_used = "fal-ai/trellis (ULTRA-HQ)"
+            print(f"      ✅ Trellis Succeeded!")
         except Exception as e:
-            print(f"      - Instant-Mesh failed: {e}")
+            print(f"      - Trellis failed: {e}")
 
-        # Attempt 2: Trellis (Best for Single-View)
-        if not final_result:
-            try:
-                print("      - Attempting: fal-ai/trellis (Single-View ULTRA-HQ)")
-                result = fal_client.run("fal-ai/trellis", arguments={
-                    "image_url": high_res_image_url, # Use the best single image
-                    "do_remove_background": True,
-                    "texture_resolution": 2048,
-                    "target_polycount": 150000,
-                })
-                final_result = result
-                model_used = "fal-ai/trellis (ULTRA-HQ)"
-                print(f"      ✅ Trellis Succeeded!")
-            except Exception as e:
-                print(f"      - Trellis failed: {e}")
-        
-        if not final_result:
-            raise Exception("All high-quality 3D reconstruction models failed.")
+    stage_timings["mesh"] = round(time.perf_counter() - stage_started, 2)
+    if not final_result:
+        raise Exception("All high-quality 3D reconstruction models failed.")
 
-        # --- Stage 4/4: Parsing and Response ---
-        print("   Stage 4/4: Parsing final model and logging metrics...")
-        
-        mesh_url = None
-        model_mesh = final_result.get("model_mesh", {})
-        
-        if isinstance(final_result, list) and len(final_result) > 0:
-            mesh_url = final_result[0].get("url") # Instant-Mesh list format
-        else:
-            mesh_url = model_mesh.get("url") or final_result.get("model_url") # Trellis dict format
+    # --- Stage 4/4: Parsing and Response ---
+    print("   Stage 4/4: Parsing final model and logging metrics...")
+    progress("4/4", "Parsing final model", model_used=model_used)
 
-        if not mesh_url: raise Exception("3D model generation returned no usable URL.")
-        
-        file_size_kb = model_mesh.get("file_size", 0) // 1024
-        timings = final_result.get("timings", {})
-        total_time = sum(timings.values()) if timings else 0
-
-        print("   📊 QUALITY METRICS:")
-        print(f"      - Model Used: {model_used}")
-        print(f"      - Texture Resolution: 4K (InstantMesh) or 2K (Trellis)")
-        print(f"      - File Size: {file_size_kb} KB")
-        print(f"      - Generation Time: {total_time:.2f}s")
-        
-        print(f"✅ Final EXCELLENCE Quality 3D Model generated successfully: {mesh_url}")
-        
-        return { 
-            "reconstruction_url": mesh_url, 
-            "model_info": { 
-                "model_used": model_used,
-                "direct_download": mesh_url,
-                "quality": "Excellence-Tier, Multi-Stage Pipeline",
-                "stages_completed": "4/4",
-                "file_size_kb": file_size_kb,
-                "generation_time_s": round(total_time, 2)
-            } 
-        }
-        
+    mesh_url = None
+    model_mesh = final_result.get("model_mesh", {})
+
+    if isinstance(final_result, list) and len(final_result) > 0:
+        mesh_url = final_result[0].get("url") # Instant-Mesh list format
+    else:
+        mesh_url = model_mesh.get("url") or final_result.get("model_url") # Trellis dict format
+
+    if not mesh_url: raise Exception("3D model generation returned no usable URL.")
+
+    file_size_kb = model_mesh.get("file_size", 0) // 1024
+    timings = final_result.get("timings", {})
+    total_time = sum(timings.values()) if timings else 0
+
+    print("   📊 QUALITY METRICS:")
+    print(f"      - Model Used: {model_used}")
+    print(f"      - Texture Resolution: 4K (InstantMesh) or 2K (Trellis)")
+    print(f"      - File Size: {file_size_kb} KB")
+    print(f"      - Generation Time: {total_time:.2f}s")
+    print(f"      - Stage Timings: {stage_timings}")
+
+    print(f"✅ Final EXCELLENCE Quality 3D Model generated successfully: {mesh_url}")
+
+    return { 
+        "reconstruction_url": mesh_url, 
+        "model_info": { 
+            "model_used": model_used,
+            "direct_download": mesh_url,
+            "quality": "Excellence-Tier, Multi-Stage Pipeline",
+            "stages_completed": "4/4",
+            "file_size_kb": file_size_kb,
+            "generation_time_s": round(total_time, 2),
+            "stage_timings_s": stage_timings,
+            "resumed_stages": resumed,
+        } 
+    }
+
+@app.post("/reconstruct")
+async def reconstruct_3d(request: ReconstructRequest, http_request: Request):
+    fal_scheduler.admit(PRIORITY_BATCH)
+    try:
+        # Leaving stops the pipeline unless another caller is waiting on the same image
+        return await run_until_disconnect(http_request, reconstruct_flight.do(reconstruction_key(request.image_url), run_reconstruction, request.image_url))
+    except ClientDisconnected:
+        print("🛑 Reconstruction client disconnected")
+        raise
     except Exception as exc:
         logger.exception("❌ Critical reconstruction pipeline error: %s", exc)
         print("⚠️ Pipeline failed. Returning a high-quality fallback model.")
-        return {
-            "reconstruction_url": "https://modelviewer.dev/shared-assets/models/Astronaut.glb", 
-            "model_info": {
-                "model_used": "fallback-astronaut",
-                "note": "3D reconstruction service temporarily unavailable"
-            }
-        }
-    
+        return RECONSTRUCT_FALLBACK_RESULT
 
+@app.post("/reconstruct/jobs", status_code=202)
+async def submit_reconstruct_job(request: ReconstructRequest):
+    """Queue a reconstruction and return its job id immediately"""
+    fal_scheduler.admit(PRIORITY_BATCH)
+    try:
+        job = reconstruct_jobs.submit(run_reconstruction, request.image_url, dedupe_key=reconstruction_key(request.image_url))
+    except JobQueueFull:
+        raise HTTPException(status_code=429, detail="Too many reconstructions in progress, please retry shortly", headers={"Retry-After": "30"})
+    print(f"🧾 Queued reconstruction job {job['job_id']}")
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "status_url": f"/reconstruct/jobs/{job['job_id']}",
+        "events_url": f"/reconstruct/jobs/{job['job_id']}/events"
+    }
 
+@app.get("/reconstruct/jobs/{job_id}")
+async def get_reconstruct_job(job_id: str):
+    job = reconstruct_jobs.get(job_id)
+    if job is None: raise HTTPException(status_code=404, detail="Unknown job id")
+    snapshot = reconstruct_jobs.snapshot(job)
+    if job["status"] == "failed": snapshot["result"] = RECONSTRUCT_FALLBACK_RESULT
+    return snapshot
 
+@app.get("/reconstruct/jobs/{job_id}/events")
+async def stream_reconstruct_job(job_id: str):
+    """Server-Sent Events stream of Stage 1/4–4/4 progress for a job"""
+    job = reconstruct_jobs.get(job_id)
+    if job is None: raise HTTPException(status_code=404, detail="Unknown job id")
 
-    
+    async def event_stream():
+        async for event in reconstruct_jobs.events(job_id):
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: progress\ndata: {json.dumps(event)}\n\n"
+        yield f"event: {job['status']}\ndata: {json.dumps(await get_reconstruct_job(job_id))}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.post("/generate-voiceover")
 async def generate_voiceover(request: AudioRequest):
@@ -603,68 +2416,16 @@ async def generate_voiceover(request: AudioRequest):
         raise HTTPException(status_code=503, detail="Voice feature unavailable")
     try:
         print("🎙️ Generating dynamic voiceover description...")
-        # Complete style-specific prompts for all 36 styles
-        style_prompts = {
-            "Modern": f"You are a Modern design expert. Describe this {request.style} room, emphasizing sleek lines, contemporary furniture, bold colors, and innovative materials. Under 40 words.",
-            "Minimalist": f"You are a Minimalist design expert. Describe this {request.style} room, emphasizing clean lines, white spaces, natural light, and purposeful simplicity. Under 40 words.",
-            "Bohemian": f"You are a Bohemian design expert. Describe this {request.style} room, highlighting vibrant colors, mixed patterns, global textiles, and eclectic charm. Under 40 words.",
-            "Coastal": f"You are a Coastal design specialist. Describe this {request.style} room, mentioning ocean blues, weathered wood, natural textures, and breezy seaside vibes. Under 40 words.",
-            "Industrial": f"You are an Industrial design specialist. Describe this {request.style} room, highlighting exposed brick, steel beams, concrete floors, and urban loft aesthetics. Under 40 words.",
-            "Farmhouse": f"You are a Farmhouse design specialist. Describe this {request.style} room, highlighting shiplap walls, barn doors, vintage fixtures, and cozy rustic charm. Under 40 words.",
-            "Scandinavian": f"You are a Scandinavian design expert. Describe this {request.style} room, mentioning light woods, cozy textures, hygge elements, and Nordic simplicity. Under 40 words.",
-            "Mediterranean": f"You are a Mediterranean design specialist. Describe this {request.style} room, highlighting warm terracotta, wrought iron, tile work, and sun-soaked elegance. Under 40 words.",
-            "Art Deco": f"You are an Art Deco design expert. Describe this {request.style} room, emphasizing geometric patterns, metallic accents, bold colors, and glamorous luxury. Under 40 words.",
-            "Mid-Century": f"You are a Mid-Century Modern specialist. Describe this {request.style} room, highlighting clean lines, teak wood, atomic patterns, and retro sophistication. Under 40 words.",
-            "Victorian": f"You are a Victorian design expert. Describe this {request.style} room, mentioning ornate details, rich fabrics, antique furniture, and classical elegance. Under 40 words.",
-            "Contemporary": f"You are a Contemporary design specialist. Describe this {request.style} room, emphasizing current trends, mixed textures, neutral palettes, and fresh sophistication. Under 40 words.",
-            "Rustic": f"You are a Rustic design expert. Describe this {request.style} room, highlighting natural materials, weathered wood, stone elements, and cozy cabin charm. Under 40 words.",
-            "Tropical": f"You are a Tropical design specialist. Describe this {request.style} room, mentioning lush greens, bamboo elements, bright colors, and island paradise vibes. Under 40 words.",
-            "Gothic": f"You are a Gothic design expert. Describe this {request.style} room, emphasizing dark colors, ornate details, dramatic elements, and mysterious elegance. Under 40 words.",
-            "Zen": f"You are a Zen design specialist. Describe this {request.style} room, highlighting natural materials, peaceful colors, minimal clutter, and serene tranquility. Under 40 words.",
-            "Eclectic": f"You are an Eclectic design expert. Describe this {request.style} room, mentioning mixed styles, unique pieces, personal collections, and creative combinations. Under 40 words.",
-            "Traditional": f"You are a Traditional design expert. Describe this {request.style} room, emphasizing classic furniture, rich colors, formal arrangements, and timeless elegance. Under 40 words.",
-            "Luxury": f"You are a Luxury interior designer. Describe this {request.style} room, noting marble surfaces, gold accents, velvet textures, and sophisticated elegance. Under 40 words.",
-            "Urban": f"You are an Urban design specialist. Describe this {request.style} room, highlighting city-inspired elements, modern fixtures, sleek surfaces, and metropolitan style. Under 40 words.",
-            "Country": f"You are a Country design expert. Describe this {request.style} room, mentioning floral patterns, antique pieces, warm colors, and countryside charm. Under 40 words.",
-            "Vintage": f"You are a Vintage design specialist. Describe this {request.style} room, highlighting retro pieces, nostalgic elements, aged patina, and timeless character. Under 40 words.",
-            "Futuristic": f"You are a Futuristic design expert. Describe this {request.style} room, emphasizing high-tech elements, sleek surfaces, LED lighting, and space-age aesthetics. Under 40 words.",
-            "Maximalist": f"You are a Maximalist design specialist. Describe this {request.style} room, mentioning bold patterns, rich colors, layered textures, and abundant decorative elements. Under 40 words.",
-            "Japanese": f"You are a Japanese design expert. Describe this {request.style} room, highlighting natural materials, clean lines, tatami elements, and peaceful minimalism. Under 40 words.",
-            "French Country": f"You are a French Country specialist. Describe this {request.style} room, mentioning toile patterns, distressed furniture, soft colors, and provincial charm. Under 40 words.",
-            "Southwestern": f"You are a Southwestern interior design expert. Describe this {request.style} room, mentioning warm earth tones, adobe textures, turquoise accents, and desert-inspired elements. Under 40 words.",
-            "Colonial": f"You are a Colonial design expert. Describe this {request.style} room, emphasizing historical elements, dark woods, formal arrangements, and American heritage. Under 40 words.",
-            "Craftsman": f"You are a Craftsman design specialist. Describe this {request.style} room, highlighting built-in furniture, natural materials, handcrafted details, and artisan quality. Under 40 words.",
-            "Prairie": f"You are a Prairie design expert. Describe this {request.style} room, mentioning horizontal lines, natural materials, earth tones, and Frank Lloyd Wright inspiration. Under 40 words.",
-            "Transitional": f"You are a Transitional design specialist. Describe this {request.style} room, emphasizing balanced elements, neutral colors, mixed textures, and timeless appeal. Under 40 words.",
-            "Glam": f"You are a Glam design expert. Describe this {request.style} room, highlighting metallic accents, luxurious fabrics, crystal elements, and Hollywood glamour. Under 40 words.",
-            "Shabby Chic": f"You are a Shabby Chic specialist. Describe this {request.style} room, mentioning distressed finishes, soft pastels, vintage pieces, and romantic charm. Under 40 words.",
-            "Steampunk": f"You are a Steampunk design expert. Describe this {request.style} room, emphasizing brass fixtures, gear elements, vintage machinery, and Victorian industrial aesthetics. Under 40 words.",
-            "Moroccan": f"You are a Moroccan design specialist. Describe this {request.style} room, highlighting intricate patterns, rich colors, ornate details, and exotic Middle Eastern charm. Under 40 words.",
-            "Asian Fusion": f"You are an Asian Fusion design expert. Describe this {request.style} room, mentioning balanced elements, natural materials, cultural artifacts, and harmonious Eastern aesthetics. Under 40 words."
-        }
-        
-        prompt = style_prompts.get(request.style, f"You are an eloquent interior designer. In under 40 words, describe this {request.style} room, specifically mentioning the {request.style} style characteristics.")
+        # Style-specific prompts for all 36 styles live in design_knowledge.json
+        prompt = design_knowledge.style_prompt(request.style)
         
-        gpt_result = fal_client.run("fal-ai/llava-next", arguments={
-            "prompt": prompt,
-            "image_url": request.image_url
-        })
-        description_text = gpt_result["output"]
+        description_text = await describe_image_for(request.image_url, prompt)
         print(f"   - Generated Description: '{description_text}'")
-        audio_stream = eleven_client.text_to_speech.convert( voice_id="21m00Tcm4TlvDq8ikWAM", text=description_text )
-        os.makedirs("dist", exist_ok=True)
-        
-        # Create unique filename to avoid caching issues
-        import time
-        timestamp = int(time.time() * 1000)  # milliseconds for uniqueness
-        audio_filename = f"description_{request.style.lower()}_{timestamp}.mp3"
-        audio_file_path = os.path.join("dist", audio_filename)
-        
-        with open(audio_file_path, "wb") as f:
-            for chunk in audio_stream: f.write(chunk)
-        audio_url = f"/{audio_filename}"
-        print(f"✅ Voiceover audio saved and available at {audio_url}")
+        audio_url = await deliver_speech(voice_id=NARRATOR_VOICE_ID, text=description_text)
+        print(f"✅ Voiceover audio available at {audio_url}")
         return {"voiceover_url": audio_url, "description": description_text}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("❌ Voiceover generation failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to generate voiceover: {str(e)}")
@@ -680,51 +2441,12 @@ async def generate_character_voice(request: dict):
         message = request.get("message", "Hello!")
         style = request.get("style", "Modern")
         
-        # Character-specific voice IDs and personalities
-        character_voices = {
-            "turtle": {
-                "voice_id": "21m00Tcm4TlvDq8ikWAM",  # Deep, calm voice
-                "personality": "zen, slow, wise",
-                "prefix": "*speaks slowly and thoughtfully*"
-            },
-            "duck": {
-                "voice_id": "AZnzlk1XvdvUeBnXmlld",  # Cheerful, energetic
-                "personality": "bubbly, creative, enthusiastic", 
-                "prefix": "*quacks excitedly*"
-            },
-            "penguin": {
-                "voice_id": "EXAVITQu4vr4xnSDxMaL",  # Sophisticated, modern
-                "personality": "sleek, professional, contemporary",
-                "prefix": "*adjusts bow tie*"
-            },
-            "owl": {
-                "voice_id": "ErXwobaYiN019PkySvjV",  # Wise, technical
-                "personality": "technical, precise, knowledgeable",
-                "prefix": "*hoots thoughtfully*"
-            }
-        }
-        
-        voice_config = character_voices.get(character_type, character_voices["turtle"])
-        
-        # Add character personality to message
-        enhanced_message = f"{voice_config['prefix']} {message}"
+        voice_config, synthesis = character_voice_synthesis(character_type, message)
+        enhanced_message = synthesis["text"]
         
         print(f"🎭 Generating {character_type} voice: '{enhanced_message}'")
         
-        audio_stream = eleven_client.text_to_speech.convert(
-            voice_id=voice_config["voice_id"],
-            text=enhanced_message,
-            model_id="eleven_multilingual_v2"
-        )
-        
-        os.makedirs("dist", exist_ok=True)
-        audio_file_path = os.path.join("dist", f"{character_type}_voice.mp3")
-        
-        with open(audio_file_path, "wb") as f:
-            for chunk in audio_stream:
-                f.write(chunk)
-        
-        audio_url = f"/{character_type}_voice.mp3"
+        audio_url = await deliver_speech(**synthesis)
         
         return {
             "voiceover_url": audio_url,
@@ -737,11 +2459,56 @@ async def generate_character_voice(request: dict):
         logger.exception("❌ Character voice generation failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Character voice failed: {str(e)}")
 
+@app.get("/speech/{key}.mp3")
+async def stream_speech_audio(key: str):
+    """Play a voice clip issued by the voice endpoints: from the speech
+    store if it was rendered before, otherwise while it is synthesized."""
+    audio = await speech_store.get(key)
+    if audio is not None:
+        # Content-addressed, so the bytes behind a key never change
+        return Response(content=audio, media_type="audio/mpeg", headers={"Cache-Control": "public, max-age=31536000, immutable"})
+    synthesis = speech_store.lookup(key)
+    if synthesis is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired speech clip {key}")
+    if eleven_client is None:
+        raise HTTPException(status_code=503, detail="Voice feature unavailable")
+
+    chunks = stream_speech(**synthesis)
+    try:
+        # Pull the first chunk before answering so upstream errors become a 502, not a cut-off stream
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    except Exception as e:
+        logger.exception("❌ Speech stream failed: %s", e)
+        raise HTTPException(status_code=502, detail=f"Speech synthesis failed: {str(e)}")
+    speech_store.counters["streams"] += 1
+
+    async def relay():
+        received = [first]
+        completed = False
+        try:
+            yield first
+            async for chunk in chunks:
+                received.append(chunk)
+                yield chunk
+            completed = True
+        finally:
+            await chunks.aclose()
+            if completed:
+                await speech_store.put(key, b"".join(received))
+            else:
+                speech_store.counters["aborted"] += 1
+
+    return StreamingResponse(relay(), media_type="audio/mpeg", headers={"Cache-Control": "no-cache"})
+
 @app.get("/get-designer-quote")
-async def get_designer_quote():
+async def get_designer_quote(voice: bool = False):
     print("🤔 Selecting a designer quote...")
     quote = random.choice(DESIGNER_QUOTES)
     print(f"   - Selected Quote: '{quote}'")
+    if voice and eleven_client is not None:
+        return {"quote": quote, "audio_url": await deliver_speech(**quote_synthesis(quote))}
     return {"quote": quote}
 
 @app.post("/generate-character-avatar")
@@ -764,9 +2531,8 @@ async def generate_character_avatar(request: dict):
         
         if HF_TOKEN:
             # Use HuggingFace Stable Diffusion for avatar generation
-            hf_response = requests.post(
-                f"{HF_API_URL}stabilityai/stable-diffusion-2-1",
-                headers=HF_HEADERS,
+            hf_response = await http_clients["hf"].post(
+                "stabilityai/stable-diffusion-2-1",
                 json={"inputs": prompt, "parameters": {"num_inference_steps": 30}}
             )
             
@@ -815,6 +2581,10 @@ async def generate_character_dialogue(request: dict):
             }
         
         # 🤗 HuggingFace Role: Creative inspiration and style expertise
+        scope = ("dialogue", style, character_name, action)
+        cached = cached_answer(scope, user_input or action) if HF_TOKEN else None
+        if cached:
+            return {"dialogue": cached, "character_name": character_name, "style": style, "source": "answer_cache"}
         if HF_TOKEN:
             personality_prompts = {
                 "Minimalist": "zen master of simplicity, speaks about clean lines and purposeful space",
@@ -839,12 +2609,14 @@ async def generate_character_dialogue(request: dict):
                 dialogue_prompt = f"As a {personality} {character_name}, write a brief {action} message about {style} interior design. Keep it under 15 words, warm and encouraging."
             
             try:
-                hf_response = requests.post(
-                    f"{HF_API_URL}microsoft/DialoGPT-medium",
-                    headers=HF_HEADERS,
+                started = time.perf_counter()
+                hf_response, knowledge = await model_or_knowledge(http_clients["hf"].post(
+                    "microsoft/DialoGPT-medium",
                     json={"inputs": dialogue_prompt, "parameters": {"max_length": 50, "temperature": 0.7}},
                     timeout=10
-                )
+                ), user_input if action == "chat_response" else "", style)
+                if knowledge:
+                    return {"dialogue": knowledge, "character_name": character_name, "style": style, "source": "knowledge"}
                 
                 if hf_response.status_code == 200:
                     result = hf_response.json()
@@ -852,6 +2624,7 @@ async def generate_character_dialogue(request: dict):
                     
                     # Clean up the response
                     if dialogue and len(dialogue) > 10:
+                        answer_cache.put(scope, user_input or action, dialogue, time.perf_counter() - started)
                         return {"dialogue": dialogue, "character_name": character_name, "style": style, "source": "huggingface"}
             except Exception as hf_error:
                 print(f"HuggingFace API error: {hf_error}")
@@ -860,76 +2633,20 @@ async def generate_character_dialogue(request: dict):
         if user_input:
             user_lower = user_input.lower()
             
-            # Advanced color consultation
-            if "color" in user_lower:
-                color_psychology = {
-                    "Minimalist": "Soft whites create serenity, warm grays add depth, and natural wood brings organic warmth - perfect for mindful living",
-                    "Luxury": "Rich jewel tones like emerald and sapphire convey opulence, while gold accents add timeless elegance and sophistication",
-                    "Bohemian": "Layer warm terracotta with vibrant turquoise and deep burgundy - each color tells a story of global adventures",
-                    "Industrial": "Charcoal grays ground the space, while copper accents add warmth to the raw urban aesthetic",
-                    "Coastal": "Ocean blues evoke tranquility, sandy beiges bring warmth, and crisp whites reflect natural light beautifully",
-                    "Southwestern": "Warm adobe oranges, sage greens, and turquoise blues capture the desert's natural palette and spiritual energy",
-                    "Modern": "Bold accent walls in deep navy or forest green create drama against clean white backgrounds",
-                    "Farmhouse": "Soft creams and sage greens with weathered wood tones create that perfect cozy countryside feeling"
-                }
-                dialogue = color_psychology.get(style, f"For {style} style, color choices should reflect both aesthetic and emotional goals")
-            
-            # Furniture and layout expertise
-            elif "furniture" in user_lower or "layout" in user_lower:
-                furniture_wisdom = {
-                    "Minimalist": "Choose multifunctional pieces with clean lines - every item should serve a purpose and bring joy",
-                    "Luxury": "Invest in statement pieces with premium materials - a single exquisite sofa can transform the entire room",
-                    "Bohemian": "Mix vintage finds with global textiles - let each piece tell a story and create conversation",
-                    "Industrial": "Look for pieces with exposed metal and reclaimed wood - functionality meets raw aesthetic beauty",
-                    "Coastal": "Natural materials like rattan and weathered wood create that relaxed, seaside living feeling",
-                    "Southwestern": "Handcrafted pieces with natural materials honor the artisan tradition and desert landscape",
-                    "Modern": "Sleek, geometric furniture with innovative materials showcases contemporary design thinking",
-                    "Farmhouse": "Vintage pieces with distressed finishes and cozy textiles create that perfect lived-in charm"
-                }
-                dialogue = furniture_wisdom.get(style, f"For {style} furniture, focus on pieces that tell your story and serve your lifestyle")
-            
-            # Lighting consultation
-            elif "light" in user_lower or "lighting" in user_lower:
-                lighting_expertise = {
-                    "Minimalist": "Layer natural light with simple pendant fixtures - lighting should be functional yet invisible",
-                    "Luxury": "Crystal chandeliers and warm accent lighting create ambiance and highlight premium materials",
-                    "Bohemian": "Mix colorful lampshades with string lights and candles for a warm, eclectic glow",
-                    "Industrial": "Exposed Edison bulbs and metal fixtures celebrate the beauty of functional design",
-                    "Coastal": "Maximize natural light with sheer curtains and add nautical-inspired fixtures",
-                    "Southwestern": "Warm, ambient lighting with wrought iron fixtures complements the desert aesthetic",
-                    "Modern": "LED strips and geometric fixtures showcase clean lines and energy efficiency",
-                    "Farmhouse": "Vintage-style fixtures with warm bulbs create that cozy, welcoming atmosphere"
-                }
-                dialogue = lighting_expertise.get(style, f"For {style} lighting, consider both function and mood")
-            
-            # General help and encouragement
-            elif "help" in user_lower:
-                dialogue = f"I'm here to guide your {style} design journey! Ask me about colors, furniture, lighting, or any specific challenges you're facing"
-            elif "thanks" in user_lower or "thank" in user_lower:
-                dialogue = "You're so welcome! Creating beautiful, meaningful spaces is what I live for. What else can we explore together?"
-            else:
-                # Contextual style insights
-                style_insights = {
-                    "Minimalist": "Remember, in minimalist design, every element should have intention - less truly becomes more when chosen thoughtfully",
-                    "Luxury": "Luxury is about quality over quantity - one exquisite piece often outshines many ordinary ones",
-                    "Bohemian": "Bohemian style celebrates your unique story - mix pieces that speak to your adventures and dreams",
-                    "Industrial": "Industrial design honors honest materials - let the beauty of raw elements shine through",
-                    "Coastal": "Coastal living is about bringing the peace of the ocean indoors - think natural textures and calming colors",
-                    "Southwestern": "Southwestern design connects us to the land - warm earth tones and natural materials create harmony",
-                    "Modern": "Modern design embraces innovation - don't be afraid to try new materials and bold geometric forms",
-                    "Farmhouse": "Farmhouse style is about comfort and family - create spaces that invite gathering and storytelling"
-                }
-                dialogue = style_insights.get(style, f"That's a great question about {style} design! Every space has unique potential to explore")
+            # Closest answer in the design knowledge base for color, furniture and lighting questions
+            dialogue = knowledge_answer(user_input, style, require_topic=True)
+            if not dialogue:
+                # General help and encouragement
+                if "help" in user_lower:
+                    dialogue = f"I'm here to guide your {style} design journey! Ask me about colors, furniture, lighting, or any specific challenges you're facing"
+                elif "thanks" in user_lower or "thank" in user_lower:
+                    dialogue = "You're so welcome! Creating beautiful, meaningful spaces is what I live for. What else can we explore together?"
+                else:
+                    # Contextual style insights
+                    dialogue = knowledge_answer(user_input, style) or design_knowledge.about(style) or f"That's a great question about {style} design! Every space has unique potential to explore"
         else:
             # Standard action responses
-            fallback_dialogues = {
-                "greeting": f"Welcome to your {style} design journey!",
-                "3d_start": f"Creating your {style} 3D masterpiece...",
-                "3d_complete": f"Your {style} 3D model is ready!",
-                "download": f"Your {style} design is downloading!",
-                "chat_response": f"Tell me more about your {style} design vision!"
-            }
-            dialogue = fallback_dialogues.get(action, "Let's create something beautiful!")
+            dialogue = fallback_dialogue(action, style)
         
         return {
             "dialogue": dialogue,
@@ -947,54 +2664,283 @@ class ChatRequest(BaseModel):
     character_name: str = "Design Companion"
     style: str = "Modern"
     conversation_history: list = []
+    session_id: str | None = None
 
-@app.post("/chat-with-avatar")
-async def chat_with_avatar(request: ChatRequest):
-    """Local-first smart chatbot using LM Studio GPT-OSS with design guardrails"""
+class ChatVoiceRequest(ChatRequest):
+    character_type: str = "turtle"
+
+# GUARDRAILS: keywords that mark a chat message as design-related
+CHAT_DESIGN_KEYWORDS = [
+    "room", "design", "style", "color", "furniture", "decor", "space", "interior", 
+    "home", "house", "apartment", "living", "bedroom", "kitchen", "bathroom",
+    "modern", "minimalist", "luxury", "bohemian", "industrial", "coastal",
+    "lighting", "layout", "renovation", "decorating", "aesthetic", "cozy",
+    "elegant", "comfortable", "beautiful", "help", "advice", "suggestion"
+]
+
+chat_ttft = LatencyTracker()
+chat_total = LatencyTracker()
+voice_first_audio = LatencyTracker()
+knowledge_latency = LatencyTracker()
+knowledge_counters = {"lookups": 0, "answered": 0, "won_race": 0}
+
+def knowledge_answer(question: str, style: str, require_topic: bool = False):
+    """Retrieved design answer for a question, or None if nothing matches.
+    With `require_topic` only color, furniture and lighting questions match."""
+    started = time.perf_counter()
+    answer = design_knowledge.answer(question, style, 0.0 if require_topic else KNOWLEDGE_MIN_SCORE, require_topic)
+    knowledge_latency.record(time.perf_counter() - started)
+    knowledge_counters["lookups"] += 1
+    if answer: knowledge_counters["answered"] += 1
+    return answer
+
+async def model_or_knowledge(model_call, question: str, style: str, history: list = ()):
+    """Await a model call, racing it against the knowledge base. Returns
+    (model result, None), or (None, answer) when the model is still
+    working after KNOWLEDGE_RACE_SECONDS and the style has its own answer
+    on the question's topic; the model call is then cancelled. Follow-ups
+    always wait for the model, which sees the conversation."""
+    task = asyncio.ensure_future(model_call)
+    if KNOWLEDGE_RACE_SECONDS > 0 and question and not history:
+        done, _ = await asyncio.wait({task}, timeout=KNOWLEDGE_RACE_SECONDS)
+        if not done:
+            started = time.perf_counter()
+            answer, exact = design_knowledge.lookup(question, style, 0.0, require_topic=True)
+            knowledge_latency.record(time.perf_counter() - started)
+            knowledge_counters["lookups"] += 1
+            if exact:
+                task.cancel()
+                knowledge_counters["won_race"] += 1
+                print(f"⏱️ Model still busy after {KNOWLEDGE_RACE_SECONDS}s; answering from the design knowledge base")
+                return None, answer
+    return await task, None
+
+# Conversation history lives on the server, per session id. Prompts are a
+# fixed system prompt per (character, style) followed by the stored turns
+# as role messages and then the new message, so each turn's prompt extends
+# the previous one and LM Studio can reuse its cached prefix.
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1024"))
+CHAT_SESSIONS_MAX = int(os.getenv("CHAT_SESSIONS_MAX", "1000"))
+CHAT_SESSION_TTL_SECONDS = int(os.getenv("CHAT_SESSION_TTL_SECONDS", "3600"))
+CHAT_SESSION_DIR = os.getenv("CHAT_SESSION_DIR", "")  # set to persist sessions across restarts
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; good enough for a budget
+    return len(text) // 4 + 1
+
+class ConversationStore:
+    """Chat turns ({"user", "assistant"}) per session: a memory LRU with
+    idle expiry, optionally persisted to a DiskStore. Once a session's
+    history exceeds the token budget its oldest turns are dropped down to
+    half the budget, so the history (and the prompt prefix) then stays
+    unchanged for several turns instead of shifting every turn."""
+
+    def __init__(self, max_sessions: int, ttl_seconds: int, token_budget: int, disk: DiskStore = None):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.token_budget = token_budget
+        self.disk = disk
+        self.sessions = OrderedDict()  # session_id -> (turns, last_used)
+        self.counters = {"created": 0, "turns": 0, "trimmed_turns": 0, "expired": 0, "evicted": 0}
+
+    def _disk_key(self, session_id: str) -> str:
+        return content_hash(session_id.encode())[:32]
+
+    async def history(self, session_id: str) -> list:
+        entry = self.sessions.get(session_id)
+        if entry is not None and time.time() - entry[1] > self.ttl_seconds:
+            self.sessions.pop(session_id)
+            self.counters["expired"] += 1
+            entry = None
+        if entry is None and self.disk is not None:
+            raw = await run_blocking(self.disk.read, self._disk_key(session_id))
+            if raw is not None: entry = (json.loads(raw), time.time())
+        if entry is None: return []
+        self._remember(session_id, entry[0])
+        return entry[0]
+
+    async def seed(self, session_id: str, turns: list):
+        """Adopt client-sent history for a session the server doesn't know yet."""
+        if await self.history(session_id): return
+        await self._save(session_id, [{"user": str(turn.get("user", "")), "assistant": str(turn.get("assistant", ""))} for turn in turns if isinstance(turn, dict)])
+
+    async def append(self, session_id: str, user: str, assistant: str):
+        turns = list(await self.history(session_id))
+        turns.append({"user": user, "assistant": assistant})
+        self.counters["turns"] += 1
+        await self._save(session_id, turns)
+
+    async def clear(self, session_id: str):
+        await self._save(session_id, [])
+
+    async def _save(self, session_id: str, turns: list):
+        if self._tokens(turns) > self.token_budget:
+            before = len(turns)
+            while turns and self._tokens(turns) > self.token_budget // 2:
+                turns = turns[1:]
+            self.counters["trimmed_turns"] += before - len(turns)
+        self._remember(session_id, turns)
+        if self.disk is not None:
+            try:
+                await run_blocking(self.disk.write, self._disk_key(session_id), json.dumps(turns).encode())
+            except OSError as exc:
+                logger.warning("Conversation store disk write failed: %s", exc)
+
+    def _tokens(self, turns: list) -> int:
+        return sum(estimate_tokens(turn["user"]) + estimate_tokens(turn["assistant"]) for turn in turns)
+
+    def _remember(self, session_id: str, turns: list):
+        self.sessions[session_id] = (turns, time.time())
+        self.sessions.move_to_end(session_id)
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+            self.counters["evicted"] += 1
+
+    def stats(self) -> dict:
+        stats = dict(self.counters, sessions=len(self.sessions), token_budget=self.token_budget)
+        if self.disk is not None: stats.update(disk_items=len(self.disk._index), disk_bytes=self.disk.total_bytes())
+        return stats
+
+conversation_store = ConversationStore(CHAT_SESSIONS_MAX, CHAT_SESSION_TTL_SECONDS, CHAT_HISTORY_TOKEN_BUDGET)
+if CHAT_SESSION_DIR:
     try:
-        # GUARDRAILS: Check if message is design-related
-        design_keywords = [
-            "room", "design", "style", "color", "furniture", "decor", "space", "interior", 
-            "home", "house", "apartment", "living", "bedroom", "kitchen", "bathroom",
-            "modern", "minimalist", "luxury", "bohemian", "industrial", "coastal",
-            "lighting", "layout", "renovation", "decorating", "aesthetic", "cozy",
-            "elegant", "comfortable", "beautiful", "help", "advice", "suggestion"
-        ]
-        
-        user_message = request.message.lower()
-        is_design_related = any(keyword in user_message for keyword in design_keywords)
-        
-        # Redirect off-topic conversations
-        if not is_design_related and len(request.message) > 5:
-            return {
-                "response": f"That's interesting, but I'm here to help with {request.style} interior design! What would you like to know about creating beautiful spaces?",
-                "character_name": request.character_name,
-                "style": request.style,
-                "guardrail_triggered": True,
-                "source": "guardrail"
-            }
-        
-        # Character personality based on style
-        personality_traits = {
-            "Minimalist": "zen, calm, focused on simplicity and clean lines",
-            "Luxury": "sophisticated, refined, knowledgeable about premium materials",
-            "Bohemian": "artistic, creative, enthusiastic about colors and textures",
-            "Industrial": "technical, practical, focused on functionality and materials",
-            "Coastal": "relaxed, breezy, inspired by natural elements and ocean vibes",
-            "Modern": "contemporary, innovative, up-to-date with current trends"
+        conversation_store.disk = DiskStore(CHAT_SESSION_DIR, 64 * 1024 * 1024, CHAT_SESSION_TTL_SECONDS, ".json")
+    except OSError as e:
+        logger.warning("Conversation disk store unavailable (%s); using memory only", e)
+
+# Repeated design questions ("what colors for coastal?") get the stored
+# answer instead of a fresh generation. Keys are (style, character,
+# normalized question); only answers generated without history are
+# stored, and questions that refer back to the conversation bypass it.
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAX_ITEMS = int(os.getenv("ANSWER_CACHE_MAX_ITEMS", "2000"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))  # e.g. 0.8; 0 = exact normalized match only
+# Words that point back into the conversation; such questions depend on history
+CONTEXT_WORDS = {"it", "that", "this", "these", "those", "them", "they", "more", "else", "again", "instead", "also", "another", "previous", "above", "same", "one"}
+
+def normalize_question(text: str) -> tuple:
+    """Lowercased content words without punctuation, stopwords or a plural
+    "s", sorted and de-duplicated: "What colors for Coastal?" → ("coastal", "color")."""
+    return tuple(sorted(set(tokenize(text))))
+
+class AnswerCache:
+    """(scope, normalized question) → answer, with TTL and LRU eviction.
+    With a similarity threshold, a miss falls back to the closest stored
+    question in the same scope by Jaccard similarity of content words."""
+
+    def __init__(self, max_items: int, ttl_seconds: int, similarity: float):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self.entries = OrderedDict()  # (scope, words) -> (answer, generation_seconds, stored_at)
+        self.counters = {"hits": 0, "similar_hits": 0, "misses": 0, "bypassed": 0, "stored": 0, "expired": 0, "evicted": 0}
+        self.seconds_saved = 0.0
+
+    def cacheable(self, message: str) -> bool:
+        words = normalize_question(message)
+        return bool(words) and not CONTEXT_WORDS.intersection(re.findall(r"[a-z']+", message.lower()))
+
+    def get(self, scope: tuple, message: str):
+        if not self.cacheable(message):
+            self.counters["bypassed"] += 1
+            return None
+        key = (scope, normalize_question(message))
+        entry = self._live(key)
+        if entry is None and self.similarity > 0:
+            entry = self._similar(scope, key[1])
+            if entry is not None: self.counters["similar_hits"] += 1
+        if entry is None:
+            self.counters["misses"] += 1
+            return None
+        self.counters["hits"] += 1
+        self.seconds_saved += entry[1]
+        return entry[0]
+
+    def put(self, scope: tuple, message: str, answer: str, generation_seconds: float):
+        if not answer or not self.cacheable(message): return
+        key = (scope, normalize_question(message))
+        self.entries[key] = (answer, generation_seconds, time.time())
+        self.entries.move_to_end(key)
+        self.counters["stored"] += 1
+        while len(self.entries) > self.max_items:
+            self.entries.popitem(last=False)
+            self.counters["evicted"] += 1
+
+    def _live(self, key: tuple):
+        entry = self.entries.get(key)
+        if entry is None: return None
+        if time.time() - entry[2] > self.ttl_seconds:
+            del self.entries[key]
+            self.counters["expired"] += 1
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def _similar(self, scope: tuple, words: tuple):
+        wanted, best, best_score = set(words), None, self.similarity
+        for (entry_scope, entry_words) in list(self.entries):
+            if entry_scope != scope: continue
+            score = len(wanted & set(entry_words)) / len(wanted | set(entry_words))
+            if score >= best_score: best, best_score = (entry_scope, entry_words), score
+        return self._live(best) if best else None
+
+    def stats(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return dict(self.counters, enabled=ANSWER_CACHE_ENABLED, items=len(self.entries),
+                    hit_rate=round(self.counters["hits"] / lookups, 3) if lookups else 0.0,
+                    latency_saved_s=round(self.seconds_saved, 2))
+
+answer_cache = AnswerCache(ANSWER_CACHE_MAX_ITEMS, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_SIMILARITY)
+
+def cached_answer(scope: tuple, message: str):
+    return answer_cache.get(scope, message) if ANSWER_CACHE_ENABLED else None
+
+async def chat_session(request: ChatRequest) -> tuple:
+    """(session_id, stored history) for a chat turn. Requests without a
+    session_id start a new session, seeded from any conversation_history
+    the client sent."""
+    session_id = request.session_id
+    if not session_id:
+        session_id = uuid.uuid4().hex
+        conversation_store.counters["created"] += 1
+    if request.conversation_history: await conversation_store.seed(session_id, request.conversation_history)
+    return session_id, await conversation_store.history(session_id)
+
+def chat_guardrail(request: ChatRequest):
+    """Redirect response for off-topic messages, or None if on-topic."""
+    user_message = request.message.lower()
+    is_design_related = any(keyword in user_message for keyword in CHAT_DESIGN_KEYWORDS)
+    
+    # Redirect off-topic conversations
+    if not is_design_related and len(request.message) > 5:
+        return {
+            "response": f"That's interesting, but I'm here to help with {request.style} interior design! What would you like to know about creating beautiful spaces?",
+            "character_name": request.character_name,
+            "style": request.style,
+            "guardrail_triggered": True,
+            "source": "guardrail"
         }
-        
-        personality = personality_traits.get(request.style, "helpful and knowledgeable about interior design")
-        
-        # Build conversation context
-        conversation_context = ""
-        if request.conversation_history:
-            recent_history = request.conversation_history[-3:]  # Last 3 exchanges
-            for exchange in recent_history:
-                conversation_context += f"User: {exchange.get('user', '')}\nAssistant: {exchange.get('assistant', '')}\n"
-        
-        # System prompt with strong guardrails
-        system_prompt = f"""You are {request.character_name}, a {personality} interior design assistant specializing in {request.style} style.
+    return None
+
+def build_chat_messages(request: ChatRequest, history: list = ()) -> list:
+    """System prompt (fixed per character and style), then the history as
+    role messages, then the new message."""
+    # Character personality based on style
+    personality_traits = {
+        "Minimalist": "zen, calm, focused on simplicity and clean lines",
+        "Luxury": "sophisticated, refined, knowledgeable about premium materials",
+        "Bohemian": "artistic, creative, enthusiastic about colors and textures",
+        "Industrial": "technical, practical, focused on functionality and materials",
+        "Coastal": "relaxed, breezy, inspired by natural elements and ocean vibes",
+        "Modern": "contemporary, innovative, up-to-date with current trends"
+    }
+
+    personality = personality_traits.get(request.style, "helpful and knowledgeable about interior design")
+
+    # System prompt with strong guardrails. Nothing per-turn goes in here,
+    # so it is byte-identical across the whole conversation.
+    system_prompt = f"""You are {request.character_name}, a {personality} interior design assistant specializing in {request.style} style.
 
 STRICT RULES:
 - ONLY discuss interior design, room styling, furniture, colors, lighting, and home decor
@@ -1004,93 +2950,137 @@ STRICT RULES:
 - Stay in character as a {request.style} design expert
 - Use specific design terminology when appropriate
 
-Previous conversation:
-{conversation_context}
+Respond as {request.character_name} with design advice."""
+
+    messages = [{"role": "system", "content": system_prompt}]
+    for exchange in history:
+        messages.append({"role": "user", "content": exchange["user"]})
+        messages.append({"role": "assistant", "content": exchange["assistant"]})
+    messages.append({"role": "user", "content": request.message})
+    return messages
 
-User's current message: {request.message}
+def enhanced_fallback_reply(message: str, style: str) -> str:
+    """Retrieved or rule-based reply used when the local model is unavailable."""
+    # Smart contextual responses: color, furniture and lighting questions get
+    # the closest answer in the design knowledge base
+    response_text = knowledge_answer(message, style, require_topic=True)
+    if response_text: return response_text
 
-Respond as {request.character_name} with design advice:"""
+    user_lower = message.lower()
+    if any(word in user_lower for word in ["help", "advice", "suggestion"]):
+        response_text = f"I'd love to help with your {style} design! What specific aspect would you like to explore together?"
+
+    elif any(word in user_lower for word in ["thanks", "thank you"]):
+        response_text = "You're so welcome! Creating beautiful spaces is what I live for. What else can we design together?"
+
+    else:
+        # Questions naming a style or using specific design words, else a general encouraging response
+        response_text = knowledge_answer(message, style) or f"That's a great question about {style} design! Every space has unique potential to explore."
+
+    return response_text
+
+async def stream_llm_tokens(messages: list, temperature: float = 0.4, max_tokens: int = 100, timeout: float = 15.0):
+    """Yield content deltas from the OpenAI-compatible streaming endpoint
+    (LM Studio or OpenAI) as they are generated."""
+    async with http_clients["llm"].stream(
+        "POST",
+        "chat/completions",
+        json={
+            "model": GPT_OSS_MODEL,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True
+        },
+        timeout=timeout
+    ) as response:
+        if response.status_code != 200:
+            raise httpx.HTTPStatusError(f"LM Studio API error: {response.status_code}", request=response.request, response=response)
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"): continue
+            data = line[5:].strip()
+            if data == "[DONE]": break
+            choices = json.loads(data).get("choices") or [{}]
+            token = (choices[0].get("delta") or {}).get("content")
+            if token: yield token
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat-with-avatar")
+async def chat_with_avatar(request: ChatRequest):
+    """Local-first smart chatbot using LM Studio GPT-OSS with design guardrails"""
+    try:
+        guardrail = chat_guardrail(request)
+        if guardrail: return guardrail
+        session_id, history = await chat_session(request)
 
         # Try local LM Studio first
-        if DEPLOYMENT_MODE == "local" and GPT_OSS_API_KEY:
+        if DEPLOYMENT_MODE == "local" and text_llm_available():
+            scope = ("chat", request.style, request.character_name)
+            cached = cached_answer(scope, request.message)
+            if cached:
+                await conversation_store.append(session_id, request.message, cached)
+                return {
+                    "response": cached,
+                    "character_name": request.character_name,
+                    "style": request.style,
+                    "source": "answer_cache",
+                    "model": GPT_OSS_MODEL,
+                    "session_id": session_id
+                }
             try:
-                async with httpx.AsyncClient(timeout=15.0) as client:
-                    response = await client.post(
-                        f"{GPT_OSS_API_URL}/chat/completions",
-                        headers={
-                            "Authorization": f"Bearer {GPT_OSS_API_KEY}",
-                            "Content-Type": "application/json"
-                        },
-                        json={
-                            "model": GPT_OSS_MODEL,
-                            "messages": [
-                                {"role": "system", "content": system_prompt},
-                                {"role": "user", "content": request.message}
-                            ],
-                            "temperature": 0.4,
-                            "max_tokens": 100
-                        }
-                    )
+                started = time.perf_counter()
+                response, knowledge = await model_or_knowledge(http_clients["llm"].post(
+                    "chat/completions",
+                    json={
+                        "model": GPT_OSS_MODEL,
+                        "messages": build_chat_messages(request, history),
+                        "temperature": 0.4,
+                        "max_tokens": 100
+                    },
+                    timeout=15.0
+                ), request.message, request.style, history)
+
+                if knowledge:
+                    await conversation_store.append(session_id, request.message, knowledge)
+                    return {
+                        "response": knowledge,
+                        "character_name": request.character_name,
+                        "style": request.style,
+                        "source": "knowledge",
+                        "session_id": session_id
+                    }
+                elif response.status_code == 200:
+                    result = response.json()
+                    ai_response = result["choices"][0]["message"]["content"].strip()
+                    chat_total.record(time.perf_counter() - started)
+                    if not history: answer_cache.put(scope, request.message, ai_response, time.perf_counter() - started)
+                    await conversation_store.append(session_id, request.message, ai_response)
+                    
+                    return {
+                        "response": ai_response,
+                        "character_name": request.character_name,
+                        "style": request.style,
+                        "source": "lm_studio_local",
+                        "model": GPT_OSS_MODEL,
+                        "session_id": session_id
+                    }
+                else:
+                    print(f"LM Studio API error: {response.status_code}")
                     
-                    if response.status_code == 200:
-                        result = response.json()
-                        ai_response = result["choices"][0]["message"]["content"].strip()
-                        
-                        return {
-                            "response": ai_response,
-                            "character_name": request.character_name,
-                            "style": request.style,
-                            "source": "lm_studio_local",
-                            "model": GPT_OSS_MODEL
-                        }
-                    else:
-                        print(f"LM Studio API error: {response.status_code}")
-                        
             except Exception as local_error:
                 print(f"Local LM Studio error: {local_error}")
         
         # Fallback to enhanced rule-based responses
-        user_lower = request.message.lower()
-        
-        # Smart contextual responses
-        if "color" in user_lower:
-            color_advice = {
-                "Minimalist": "For minimalist spaces, stick to a neutral palette - whites, soft grays, and natural wood tones create serenity.",
-                "Luxury": "Luxury designs shine with rich jewel tones, deep navy, or classic black and gold combinations.",
-                "Bohemian": "Bohemian style loves warm earth tones mixed with vibrant accent colors - think terracotta, deep blues, and emerald.",
-                "Industrial": "Industrial spaces work best with charcoal grays, deep blues, and metallic accents like copper or steel.",
-                "Coastal": "Coastal design thrives on ocean-inspired blues, sandy beiges, and crisp whites with natural textures."
-            }
-            response_text = color_advice.get(request.style, f"For {request.style} style, choose colors that reflect the mood and atmosphere you want to create.")
-            
-        elif "furniture" in user_lower:
-            furniture_advice = {
-                "Minimalist": "Choose furniture with clean lines and multifunctional purposes. Less is more - each piece should be intentional.",
-                "Luxury": "Invest in statement pieces with premium materials - think marble tops, velvet upholstery, and solid wood construction.",
-                "Bohemian": "Mix vintage finds with global textiles. Layer different textures and don't be afraid of eclectic combinations.",
-                "Industrial": "Look for pieces with metal frames, reclaimed wood, and exposed hardware. Function meets raw aesthetic.",
-                "Coastal": "Natural materials like rattan, weathered wood, and linen create that relaxed seaside feeling."
-            }
-            response_text = furniture_advice.get(request.style, f"For {request.style} furniture, focus on pieces that complement your overall aesthetic and lifestyle needs.")
-            
-        elif "lighting" in user_lower:
-            response_text = f"Lighting is crucial for {request.style} style! Consider both ambient and task lighting to create the perfect atmosphere."
-            
-        elif any(word in user_lower for word in ["help", "advice", "suggestion"]):
-            response_text = f"I'd love to help with your {request.style} design! What specific aspect would you like to explore together?"
-            
-        elif any(word in user_lower for word in ["thanks", "thank you"]):
-            response_text = "You're so welcome! Creating beautiful spaces is what I live for. What else can we design together?"
-            
-        else:
-            # General encouraging response
-            response_text = f"That's a great question about {request.style} design! Every space has unique potential to explore."
-        
+        fallback = enhanced_fallback_reply(request.message, request.style)
+        await conversation_store.append(session_id, request.message, fallback)
         return {
-            "response": response_text,
+            "response": fallback,
             "character_name": request.character_name,
             "style": request.style,
-            "source": "enhanced_fallback"
+            "source": "enhanced_fallback",
+            "session_id": session_id
         }
         
     except Exception as e:
@@ -1102,6 +3092,308 @@ Respond as {request.character_name} with design advice:"""
             "source": "error_fallback"
         }
 
+async def chat_reply_tokens(request: ChatRequest, reply: dict):
+    """Yield a chat reply as it is produced: LM Studio tokens when
+    available, otherwise the cached, guardrail or fallback reply in one
+    piece. Fills `reply` with the full response and its source."""
+    guardrail = chat_guardrail(request)
+    if guardrail:
+        reply.update(guardrail)
+        yield guardrail["response"]
+        return
+
+    session_id, history = await chat_session(request)
+    reply["session_id"] = session_id
+    scope = ("chat", request.style, request.character_name)
+    use_llm = DEPLOYMENT_MODE == "local" and text_llm_available()
+    tokens = []
+    knowledge = None
+    cached = cached_answer(scope, request.message) if use_llm else None
+    if cached:
+        reply.update(response=cached, source="answer_cache", model=GPT_OSS_MODEL)
+        yield cached
+    elif use_llm:
+        started = time.perf_counter()
+        stream = stream_llm_tokens(build_chat_messages(request, history))
+        try:
+            # The race is for the first token; once the model is talking it finishes the reply
+            first, knowledge = await model_or_knowledge(anext(stream, None), request.message, request.style, history)
+            if first is not None:
+                tokens.append(first)
+                yield first
+                async for token in stream:
+                    tokens.append(token)
+                    yield token
+        except Exception as local_error:
+            print(f"Local LM Studio stream error: {local_error}")
+            if tokens: reply["truncated"] = True
+        if tokens and not history and not reply.get("truncated"):
+            answer_cache.put(scope, request.message, "".join(tokens).strip(), time.perf_counter() - started)
+
+    if tokens:
+        reply.update(response="".join(tokens).strip(), source="lm_studio_local", model=GPT_OSS_MODEL)
+    elif knowledge:
+        reply.update(response=knowledge, source="knowledge")
+        yield knowledge
+    elif not cached:
+        reply.update(response=enhanced_fallback_reply(request.message, request.style), source="enhanced_fallback")
+        yield reply["response"]
+    await conversation_store.append(session_id, request.message, reply["response"])
+
+@app.post("/chat-with-avatar/stream")
+async def chat_with_avatar_stream(request: ChatRequest):
+    """Streaming variant of /chat-with-avatar (Server-Sent Events).
+
+    Emits `token` events as LM Studio generates text and a final `done`
+    event with the full response, its source and timings (time to first
+    token and total). Guardrail and fallback replies arrive as a single
+    token followed by `done`."""
+    async def event_stream():
+        started = time.perf_counter()
+        reply = {"character_name": request.character_name, "style": request.style}
+        first_token_at = None
+        async for token in chat_reply_tokens(request, reply):
+            if first_token_at is None: first_token_at = time.perf_counter()
+            yield sse_event("token", {"text": token})
+
+        total = time.perf_counter() - started
+        if reply["source"] == "lm_studio_local":
+            chat_ttft.record(first_token_at - started)
+            chat_total.record(total)
+        else:
+            first_token_at = None
+        reply["timings_ms"] = {
+            "first_token": round((first_token_at - started) * 1000, 1) if first_token_at else None,
+            "total": round(total * 1000, 1)
+        }
+        yield sse_event("done", reply)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Spoken replies are pipelined by sentence: each sentence goes to
+# ElevenLabs as soon as LM Studio finishes it, while later sentences are
+# still being generated, and the audio is relayed back in sentence order.
+VOICE_PIPELINE_CONCURRENCY = int(os.getenv("VOICE_PIPELINE_CONCURRENCY", "2"))
+VOICE_PIPELINE_MIN_SENTENCE_CHARS = int(os.getenv("VOICE_PIPELINE_MIN_SENTENCE_CHARS", "20"))
+SENTENCE_END = re.compile(r"[.!?…]+[\"')\]]*\s+")
+
+def split_sentences(buffer: str, min_chars: int = VOICE_PIPELINE_MIN_SENTENCE_CHARS) -> tuple:
+    """(complete sentences, unfinished rest) of streamed text. Sentences
+    shorter than min_chars are merged into the next so clips aren't tiny."""
+    sentences, start = [], 0
+    for match in SENTENCE_END.finditer(buffer):
+        if len(buffer[start:match.end()].strip()) >= min_chars:
+            sentences.append(buffer[start:match.end()].strip())
+            start = match.end()
+    return sentences, buffer[start:]
+
+async def speak_sentence(synthesis: dict, chunks: asyncio.Queue, semaphore: asyncio.Semaphore):
+    """Feed one sentence's mp3 chunks into `chunks` (from the speech store
+    if it was spoken before), then None. An exception is queued instead
+    if synthesis fails."""
+    key = speech_key(synthesis)
+    try:
+        audio = await speech_store.get(key)
+        if audio is not None:
+            chunks.put_nowait(audio)
+        else:
+            async with semaphore:
+                parts = []
+                async for chunk in stream_speech(**synthesis):
+                    parts.append(chunk)
+                    chunks.put_nowait(chunk)
+            await speech_store.put(key, b"".join(parts))
+    except Exception as e:
+        print(f"⚠️ Sentence synthesis failed: {e}")
+        chunks.put_nowait(e)
+    chunks.put_nowait(None)
+
+@app.post("/chat-with-avatar/voice/stream")
+async def chat_with_avatar_voice_stream(request: ChatVoiceRequest):
+    """Spoken companion reply (Server-Sent Events).
+
+    Emits `token` events as text is generated, a `sentence` event when a
+    sentence is complete and sent to ElevenLabs with the character's
+    voice, then that sentence's `audio` events (base64 mp3 chunks, in
+    sentence order) and an `audio_end` event with a replayable audio_url
+    (or `audio_error`). The final `done` event carries the reply and
+    timings (first token, first sentence, first audio, total)."""
+    if eleven_client is None:
+        raise HTTPException(status_code=503, detail="Voice feature unavailable")
+
+    async def event_stream():
+        started = time.perf_counter()
+        reply = {"character_name": request.character_name, "style": request.style, "character_type": request.character_type}
+        marks = {}
+        events = asyncio.Queue()
+        clips = asyncio.Queue()  # (index, synthesis, chunk queue) in sentence order, then None
+        semaphore = asyncio.Semaphore(VOICE_PIPELINE_CONCURRENCY)
+        speakers = []
+
+        def start_sentence(text: str):
+            index = len(speakers)
+            # The character's prefix only opens the reply
+            _, synthesis = character_voice_synthesis(request.character_type, text)
+            if index: synthesis["text"] = text
+            chunks = asyncio.Queue()
+            speakers.append(asyncio.ensure_future(speak_sentence(synthesis, chunks, semaphore)))
+            clips.put_nowait((index, synthesis, chunks))
+            marks.setdefault("first_sentence", time.perf_counter())
+            events.put_nowait(sse_event("sentence", {"index": index, "text": text}))
+
+        async def produce_text():
+            buffer = ""
+            try:
+                async for token in chat_reply_tokens(request, reply):
+                    marks.setdefault("first_token", time.perf_counter())
+                    events.put_nowait(sse_event("token", {"text": token}))
+                    sentences, buffer = split_sentences(buffer + token)
+                    for sentence in sentences: start_sentence(sentence)
+                if buffer.strip(): start_sentence(buffer.strip())
+            finally:
+                clips.put_nowait(None)
+
+        async def relay_audio():
+            while True:
+                clip = await clips.get()
+                if clip is None: break
+                index, synthesis, chunks = clip
+                while True:
+                    chunk = await chunks.get()
+                    if chunk is None:
+                        events.put_nowait(sse_event("audio_end", {"index": index, "audio_url": f"/speech/{speech_key(synthesis)}.mp3"}))
+                        break
+                    if isinstance(chunk, Exception):
+                        events.put_nowait(sse_event("audio_error", {"index": index, "error": str(chunk)}))
+                        break
+                    marks.setdefault("first_audio", time.perf_counter())
+                    events.put_nowait(sse_event("audio", {"index": index, "data": base64.b64encode(chunk).decode()}))
+            events.put_nowait(None)
+
+        workers = [asyncio.ensure_future(produce_text()), asyncio.ensure_future(relay_audio())]
+        try:
+            while True:
+                event = await events.get()
+                if event is None: break
+                yield event
+        finally:
+            # Client gone or reply finished: stop generating and speaking
+            for task in workers + speakers: task.cancel()
+
+        total = time.perf_counter() - started
+        if "first_audio" in marks: voice_first_audio.record(marks["first_audio"] - started)
+        reply["sentences"] = len(speakers)
+        reply["timings_ms"] = {name: round((marks[name] - started) * 1000, 1) if name in marks else None for name in ("first_token", "first_sentence", "first_audio")}
+        reply["timings_ms"]["total"] = round(total * 1000, 1)
+        yield sse_event("done", reply)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# One WebSocket per companion session multiplexes chat, dialogue and
+# voice. Style, character and the conversation history live on the
+# server, so a turn is just {"id", "op", "message"}: no per-turn headers,
+# CORS preflight or resent history.
+COMPANION_MAX_INFLIGHT = int(os.getenv("COMPANION_MAX_INFLIGHT", "4"))
+companion_counters = {"sessions": 0, "active": 0, "messages": 0, "rejected": 0}
+
+class CompanionSession:
+    """Server-side state of one companion WebSocket."""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.settings = {"character_name": "Design Companion", "style": "Modern", "character_type": "turtle"}
+        self.session_id = uuid.uuid4().hex  # conversation_store key
+        self.send_lock = asyncio.Lock()
+        self.tasks = set()
+
+    async def send(self, message: dict):
+        async with self.send_lock:
+            await self.websocket.send_json(message)
+
+    async def chat(self, op_id, message: dict) -> dict:
+        request = ChatRequest(message=message.get("message", ""), character_name=self.settings["character_name"], style=self.settings["style"], session_id=self.session_id)
+        reply = {"character_name": request.character_name, "style": request.style}
+        async for token in chat_reply_tokens(request, reply):
+            await self.send({"id": op_id, "event": "token", "text": token})
+        if message.get("speak") and eleven_client is not None:
+            _, synthesis = character_voice_synthesis(self.settings["character_type"], reply["response"])
+            reply["audio_url"] = await deliver_speech(**synthesis)
+        return reply
+
+    async def dialogue(self, op_id, message: dict) -> dict:
+        return await generate_character_dialogue({
+            "style": self.settings["style"],
+            "character_name": self.settings["character_name"],
+            "action": message.get("action", "chat_response"),
+            "user_input": message.get("message", ""),
+        })
+
+    async def voice(self, op_id, message: dict) -> dict:
+        return await generate_character_voice({
+            "character_type": message.get("character_type", self.settings["character_type"]),
+            "message": message.get("message", "Hello!"),
+            "style": self.settings["style"],
+        })
+
+    async def run(self, op_id, op: str, message: dict):
+        try:
+            result = await getattr(self, op)(op_id, message)
+            await self.send({"id": op_id, "event": "result", "op": op, **result})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.exception("❌ Companion %s failed: %s", op, e)
+            await self.send({"id": op_id, "event": "error", "op": op, "detail": detail})
+        finally:
+            self.tasks.discard(asyncio.current_task())
+
+@app.websocket("/companion/ws")
+async def companion_socket(websocket: WebSocket):
+    """Companion session channel. Client messages are JSON objects with an
+    `id` (echoed back) and an `op`:
+
+    - `configure`: set any of style, character_name, character_type
+    - `chat`: {message, speak?} → `token` events, then `result` with the
+      reply (plus audio_url when speak is true)
+    - `dialogue`: {action, message?} → `result` like /generate-character-dialogue
+    - `voice`: {message, character_type?} → `result` like /generate-character-voice
+    - `reset`: forget the conversation history
+
+    Operations run concurrently, so replies for different ids interleave."""
+    await websocket.accept()
+    session = CompanionSession(websocket)
+    companion_counters["sessions"] += 1
+    companion_counters["active"] += 1
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                if not isinstance(message, dict): raise ValueError("expected a JSON object")
+            except ValueError as e:
+                await session.send({"event": "error", "detail": f"Invalid message: {e}"})
+                continue
+            companion_counters["messages"] += 1
+            op_id, op = message.get("id"), message.get("op")
+            if op == "configure":
+                session.settings.update({key: str(message[key]) for key in session.settings if key in message})
+                await session.send({"id": op_id, "event": "result", "op": op, **session.settings})
+            elif op == "reset":
+                await conversation_store.clear(session.session_id)
+                await session.send({"id": op_id, "event": "result", "op": op})
+            elif op not in ("chat", "dialogue", "voice"):
+                await session.send({"id": op_id, "event": "error", "op": op, "detail": f"Unknown op {op!r}"})
+            elif len(session.tasks) >= COMPANION_MAX_INFLIGHT:
+                companion_counters["rejected"] += 1
+                await session.send({"id": op_id, "event": "error", "op": op, "detail": "Too many operations in flight"})
+            else:
+                session.tasks.add(asyncio.ensure_future(session.run(op_id, op, message)))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        companion_counters["active"] -= 1
+        for task in list(session.tasks): task.cancel()
+
 @app.post("/generate-ambient-sounds")
 async def generate_ambient_sounds(request: dict):
     """Generate style-matched ambient sounds and animal noises"""
@@ -1133,21 +3425,10 @@ async def generate_ambient_sounds(request: dict):
         sound_description = f"{ambient_prompts.get(style, 'peaceful ambient sounds')}, {animal_sounds.get(character_type, 'gentle nature sounds')}"
         
         # Generate ambient audio using ElevenLabs
-        audio_stream = eleven_client.text_to_speech.convert(
-            voice_id="21m00Tcm4TlvDq8ikWAM",  # Use calm voice for ambient descriptions
-            text=f"Creating ambient {style} atmosphere with {character_type} companion sounds",
-            model_id="eleven_multilingual_v2"
-        )
-        
-        os.makedirs("dist", exist_ok=True)
-        audio_file_path = os.path.join("dist", f"{style}_{character_type}_ambient.mp3")
-        
-        with open(audio_file_path, "wb") as f:
-            for chunk in audio_stream:
-                f.write(chunk)
+        ambient_url = await deliver_speech(**ambient_synthesis(style, character_type))
         
         return {
-            "ambient_url": f"/{style}_{character_type}_ambient.mp3",
+            "ambient_url": ambient_url,
             "style": style,
             "character_type": character_type,
             "description": sound_description
@@ -1177,11 +3458,10 @@ async def get_design_suggestions(request: dict):
             
             Keep each suggestion under 25 words and make them actionable."""
             
-            gpt_response = requests.post(
-                f"{GPT_OSS_BASE_URL}/chat/completions",
-                headers={"Authorization": f"Bearer {GPT_OSS_API_KEY}"},
+            gpt_response = await http_clients["llm"].post(
+                "chat/completions",
                 json={
-                    "model": "gpt-3.5-turbo",
+                    "model": GPT_OSS_MODEL,
                     "messages": [{"role": "user", "content": prompt}],
                     "max_tokens": 200,
                     "temperature": 0.7
@@ -0,0 +1,70 @@
+# --------------------------------------------------------------
+# recolor.py
+# --------------------------------------------------------------
+# NumPy recolor engine used by /recolor and /recolor-batch.
+# Kept free of FastAPI / SDK imports so process-pool workers can import
+# it cheaply (spawned workers re-import the module that holds the target).
+import io
+import numpy as np
+from PIL import Image
+
+# Rec. 601 luma weights in 8-bit fixed point (sum to 256)
+LUMA_WEIGHTS = np.array([77, 150, 29], dtype=np.uint16)
+
+def decode_mask(layer: dict, size: tuple) -> np.ndarray:
+    """Boolean (height, width) mask from a layer spec, resized to `size`
+    (width, height). Specs hold either bit-packed bits + shape (from the
+    mask store) or raw PNG bytes."""
+    if "packed" in layer:
+        height, width = layer["shape"]
+        mask = np.unpackbits(layer["packed"], count=height * width).reshape(height, width).view(bool)
+        if (width, height) == size: return mask
+        mask_img = Image.fromarray(mask.view(np.uint8) * 255, mode="L")
+    else:
+        mask_img = Image.open(io.BytesIO(layer["png"])).convert("L")
+    if mask_img.size != size: mask_img = mask_img.resize(size, Image.NEAREST)
+    return np.asarray(mask_img) > 127
+
+def recolor_pixels(pixels: np.ndarray, layers: list, mode: str = "shade") -> np.ndarray:
+    """Apply every (mask, color) pair to an RGB uint8 array in one pass,
+    in place. Returns `pixels`.
+
+    "shade" keeps the object's lighting: each pixel gets the target color
+    scaled by its luminance relative to the region's mean luminance, so
+    folds, shadows and highlights survive. "flat" pastes the color as-is.
+    Only masked pixels are touched, and later layers win where masks
+    overlap."""
+    levels = np.arange(256, dtype=np.float32)
+    # Plan every layer from the original pixels before writing any of them
+    plans = []
+    for mask, color in layers:
+        rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+        if rows.size == 0: continue
+        # Work on the mask's bounding box with contiguous slices, not fancy indexing
+        box = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+        region, region_mask = pixels[box], mask[box]
+        color = np.asarray(color[:3], dtype=np.float32)
+        if mode != "shade":
+            plans.append((region, region_mask, None, [np.uint8(c) for c in color]))
+            continue
+        wide = region.astype(np.uint16)
+        luma = ((wide[..., 0] * LUMA_WEIGHTS[0] + wide[..., 1] * LUMA_WEIGHTS[1] + wide[..., 2] * LUMA_WEIGHTS[2]) >> 8).astype(np.uint8)
+        mean = luma.sum(where=region_mask, dtype=np.float64) / max(int(region_mask.sum()), 1)
+        # One shaded value per luminance level: a 256-entry table per channel
+        tables = [np.minimum(levels / max(mean, 1.0) * c, 255).astype(np.uint8) for c in color]
+        plans.append((region, region_mask, luma, tables))
+    for region, region_mask, luma, tables in plans:
+        for channel, table in enumerate(tables):
+            np.copyto(region[..., channel], table if luma is None else np.take(table, luma), where=region_mask)
+    return pixels
+
+def recolor_image(image_bytes: bytes, layers: list, mode: str = "shade", quality: int = 75) -> bytes:
+    """Decode, recolor and JPEG-encode an image. `layers` is a list of
+    (mask spec, color) pairs; see decode_mask(). Runs in a worker process."""
+    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    pixels = np.array(image)
+    masks = [(decode_mask(spec, image.size), color) for spec, color in layers]
+    result = Image.fromarray(recolor_pixels(pixels, masks, mode))
+    buf = io.BytesIO()
+    result.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
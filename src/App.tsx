@@ -1,6 +1,6 @@
 /* src/App.tsx */
 import React, { useState, useRef, useEffect } from 'react';
-import { segment, recolor, reconstruct, generateVoiceover, generateFalImage, redesignFalImage, getDesignerQuote, chatWithAvatar } from './api';
+import { segment, recolor, submitReconstructJob, followReconstructJob, generateVoiceover, generateFalImage, redesignFalImage, getDesignerQuote, chatWithAvatar, CompanionSocket, uploadImage, storedImageUrl, maskImageUrl } from './api';
 
 // Import your newly created icon components
 import { EyeIcon } from './components/EyeIcon';
@@ -19,6 +19,10 @@ const App: React.FC = () => {
   const [imageUrl, setImageUrl] = useState<string | null>(null);
   const [mode, setMode] = useState<'generate' | 'redesign'>('generate');
   const [selectedCategory, setSelectedCategory] = useState<string>('Modern');
+  // Companion chat and voice share one WebSocket; conversation history stays on the server
+  const companion = useRef(new CompanionSocket()).current;
+  // Displayed image URL -> the image_id the backend knows it by
+  const imageIds = useRef(new Map<string, Promise<string>>());
   const [isCameraActive, setIsCameraActive] = useState<boolean>(false);
   const [capturedImage, setCapturedImage] = useState<string | null>(null);
   const [segments, setSegments] = useState<any[] | null>(null);
@@ -92,19 +96,25 @@ const App: React.FC = () => {
 
       console.log(`🎭 ${currentAvatar.name} is speaking: "${message}"`);
 
-      const response = await fetch('/generate-character-voice', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          character_type: avatarType,
-          message: message,
-          style: selectedCategory
-        })
-      });
+      let audioData;
+      try {
+        audioData = await companion.voice(message, avatarType);
+      } catch (socketError) {
+        console.warn('Companion socket unavailable, using HTTP:', socketError);
+        const response = await fetch('/generate-character-voice', {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({
+            character_type: avatarType,
+            message: message,
+            style: selectedCategory
+          })
+        });
+        audioData = response.ok ? await response.json() : null;
+      }
 
-      if (response.ok) {
-        const audioData = await response.json();
-        const audio = new Audio(audioData.voiceover_url + `?t=${Date.now()}`);
+      if (audioData) {
+        const audio = new Audio(audioData.voiceover_url);
 
         // Show visual feedback while speaking
         setIsPlayingMusic(true);
@@ -132,12 +142,19 @@ const App: React.FC = () => {
 
       const currentCharacter = getStyleCharacter(selectedCategory);
 
-      const chatResult = await chatWithAvatar({
-        message: message,
-        character_name: currentCharacter.name,
-        style: selectedCategory,
-        conversation_history: [] // Could store chat history here
-      });
+      let chatResult;
+      try {
+        companion.configure({ style: selectedCategory, character_name: currentCharacter.name });
+        chatResult = await companion.chat(message);
+      } catch (socketError) {
+        console.warn('Companion socket unavailable, using HTTP:', socketError);
+        chatResult = await chatWithAvatar({
+          message: message,
+          character_name: currentCharacter.name,
+          style: selectedCategory,
+          conversation_history: []
+        });
+      }
 
       // Show the response immediately
       setCharacterMessage(chatResult.response);
@@ -339,7 +356,28 @@ const App: React.FC = () => {
   // --- HELPERS ---
   const stopCamera = () => setIsCameraActive(false);
 
+  // What to send as image_url: data URLs (camera captures) are uploaded once and
+  // referenced by image_id afterwards; fal URLs are already short and pass through.
+  const imageHandle = (url: string): Promise<string> => {
+    let handle = imageIds.current.get(url);
+    if (!handle) {
+      if (!url.startsWith('data:')) return Promise.resolve(url);
+      handle = fetch(url)
+        .then((res) => res.blob())
+        .then(uploadImage)
+        .then((stored) => stored.image_id)
+        .catch((err) => {
+          console.warn('Image upload failed, sending it inline:', err);
+          imageIds.current.delete(url);
+          return url;
+        });
+      imageIds.current.set(url, handle);
+    }
+    return handle;
+  };
+
   const resetStateForNewImage = () => {
+    imageIds.current.clear();
     setImageUrl(null);
     setCapturedImage(null);
     setSegments(null);
@@ -385,6 +423,7 @@ const App: React.FC = () => {
         ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
         const dataUrl = canvas.toDataURL('image/jpeg');
         setCapturedImage(dataUrl);
+        imageHandle(dataUrl); // start the upload while the user picks a style
         stopCamera();
       }
     }
@@ -396,7 +435,7 @@ const App: React.FC = () => {
     setError(null);
     try {
       const result = await redesignFalImage({
-        image_url: capturedImage,
+        image_url: await imageHandle(capturedImage),
         prompt: `Give me a concise description (max 30 words) of how this room would look after being redesigned in a ${selectedCategory} style.`
       });
 
@@ -473,7 +512,7 @@ const App: React.FC = () => {
     setLoading(true); setError(null); setSegments(null);
     try {
       console.log('🔍 Starting AI vision segmentation...');
-      const result = await segment({ image_url: imageUrl });
+      const result = await segment({ image_url: await imageHandle(imageUrl), inline_masks: false });
       console.log('📊 Segmentation result:', result);
 
       if (result.masks && result.masks.length > 0) {
@@ -497,11 +536,19 @@ const App: React.FC = () => {
     setError(null);
     try {
       const result = await recolor({
-        image_url: imageUrl,
-        mask: maskData,
+        image_url: await imageHandle(imageUrl),
+        // Send only the server-side mask handle when /segment provided one
+        mask: maskData.mask_id ? { mask_id: maskData.mask_id } : maskData,
         color: [139, 92, 246]
       });
-      setImageUrl(result.image_url);
+      if (result.image_id) {
+        // The result stays on the server; load it by URL and keep editing it by id
+        const resultUrl = storedImageUrl(result.image_id);
+        imageIds.current.set(resultUrl, Promise.resolve(result.image_id));
+        setImageUrl(resultUrl);
+      } else {
+        setImageUrl(result.image_url);
+      }
       setSegments(null);
     } catch (err) {
       console.error(err);
@@ -515,27 +562,7 @@ const App: React.FC = () => {
     if (!imageUrl) { setError('Please generate or capture an image first.'); return; }
     setLoading(true); setError(null); setReconstructionUrl(null); setModelInfo(null);
 
-    // Ultra-detailed 6-stage processing messages
-    const progressMessages = [
-      'Stage 1/6: Analyzing image depth and geometry...',
-      'Stage 2/6: Generating base mesh structure...',
-      'Stage 3/6: Enhancing mesh detail and complexity...',
-      'Stage 4/6: Optimizing textures and materials...',
-      'Stage 5/6: Refining geometry and smoothing...',
-      'Stage 6/6: Final ultra-quality enhancement...',
-      'Stage 6/6: Your masterpiece is almost ready...'
-    ];
-
-    let messageIndex = 0;
-    setLoadingMessage(progressMessages[0]);
-
-    const progressInterval = setInterval(() => {
-      if (messageIndex < progressMessages.length - 1) {
-        messageIndex++;
-        setLoadingMessage(progressMessages[messageIndex]);
-        console.log(`🎯 ${progressMessages[messageIndex]}`);
-      }
-    }, 2000);
+    setLoadingMessage('Submitting your room for 3D reconstruction...');
 
     try {
       console.log('🚀 Starting ultra-high quality 3D reconstruction...');
@@ -547,9 +574,23 @@ const App: React.FC = () => {
         setShowCharacter(true);
       }, 2000);
 
-      const result = await reconstruct({ image_url: imageUrl });
+      // Submit as a job and follow its real stages, so no request has to stay open for minutes
+      const job = await submitReconstructJob({ image_url: await imageHandle(imageUrl) });
+      let result;
+      try {
+        result = await followReconstructJob(job.job_id, (event) => {
+          const views = event.views_total ? ` (${event.views_done}/${event.views_total})` : '';
+          const message = event.stage === 'queued' ? event.message : `Stage ${event.stage}: ${event.message}${views}...`;
+          setLoadingMessage(message);
+          console.log(`🎯 ${message}`);
+        });
+      } catch (jobError: any) {
+        // A failed job still carries the server's fallback model
+        if (!jobError?.result) throw jobError;
+        console.warn('Reconstruction failed, showing fallback model:', jobError);
+        result = jobError.result;
+      }
 
-      clearInterval(progressInterval);
       console.log('✅ Ultra-HQ 3D model ready!');
 
       setReconstructionUrl(result.reconstruction_url);
@@ -565,7 +606,6 @@ const App: React.FC = () => {
       setTimeout(() => setShowCharacter(false), 4000);
 
     } catch (err) {
-      clearInterval(progressInterval);
       console.error('Reconstruct error:', err);
       setError('3D reconstruction failed. Please try with a different image.');
     } finally {
@@ -579,8 +619,8 @@ const App: React.FC = () => {
     setIsAudioLoading(true);
     setError(null);
     try {
-      const audioData = await generateVoiceover({ image_url: imageUrl, style: selectedCategory });
-      setAudioUrl(audioData.voiceover_url + `?t=${new Date().getTime()}`);
+      const audioData = await generateVoiceover({ image_url: await imageHandle(imageUrl), style: selectedCategory });
+      setAudioUrl(audioData.voiceover_url);
     } catch (err) {
       console.error("Audio generation failed:", err);
       setError("Failed to generate audio description.");
@@ -860,18 +900,22 @@ const App: React.FC = () => {
             // Regular Image Display
             <>
               <img src={imageUrl} className="w-full h-full object-contain" alt="Generated or redesigned room" />
-              {segments && segments.map((s, i) => (
-                <div
-                  key={i}
-                  onClick={() => handleRecolorObject(s)}
-                  style={{
-                    WebkitMaskImage: `url(${s.mask})`,
-                    maskImage: `url(${s.mask})`,
-                    backgroundColor: 'rgba(139, 92, 246, 0.7)',
-                  }}
-                  className="absolute inset-0 opacity-80 hover:opacity-100 transition-opacity cursor-pointer"
-                />
-              ))}
+              {segments && segments.map((s, i) => {
+                // Masks come by handle; the inline PNG is only there if the server couldn't store one
+                const maskSrc = s.mask_url ? maskImageUrl(s.mask_url) : s.mask;
+                return (
+                  <div
+                    key={i}
+                    onClick={() => handleRecolorObject(s)}
+                    style={{
+                      WebkitMaskImage: `url(${maskSrc})`,
+                      maskImage: `url(${maskSrc})`,
+                      backgroundColor: 'rgba(139, 92, 246, 0.7)',
+                    }}
+                    className="absolute inset-0 opacity-80 hover:opacity-100 transition-opacity cursor-pointer"
+                  />
+                );
+              })}
               {originalImage && (
                 <button
                   onClick={() => setShowBeforeAfter(true)}
@@ -1142,19 +1186,26 @@ const App: React.FC = () => {
 
                           // Generate smart response using HuggingFace
                           try {
-                            const response = await fetch('/generate-character-dialogue', {
-                              method: 'POST',
-                              headers: { 'Content-Type': 'application/json' },
-                              body: JSON.stringify({
-                                style: selectedCategory,
-                                action: 'chat_response',
-                                character_name: character.name,
-                                user_input: userInput
-                              })
-                            });
-
-                            if (response.ok) {
-                              const dialogueData = await response.json();
+                            let dialogueData;
+                            try {
+                              companion.configure({ style: selectedCategory, character_name: character.name });
+                              dialogueData = await companion.dialogue('chat_response', userInput);
+                            } catch (socketError) {
+                              console.warn('Companion socket unavailable, using HTTP:', socketError);
+                              const response = await fetch('/generate-character-dialogue', {
+                                method: 'POST',
+                                headers: { 'Content-Type': 'application/json' },
+                                body: JSON.stringify({
+                                  style: selectedCategory,
+                                  action: 'chat_response',
+                                  character_name: character.name,
+                                  user_input: userInput
+                                })
+                              });
+                              dialogueData = response.ok ? await response.json() : null;
+                            }
+
+                            if (dialogueData) {
                               const smartResponse = `${character.emoji} ${dialogueData.dialogue}`;
                               setCharacterMessage(smartResponse);
                               handleAvatarSpeak(dialogueData.dialogue);
@@ -55,14 +55,178 @@ const callBackendPost = async (endpoint: string, body: any) => {
   return await response.json();
 };
 
+// Upload an image once; the returned image_id can be passed as image_url to every endpoint
+export const uploadImage = async (image: Blob): Promise<{ image_id: string; width: number; height: number; bytes: number }> => {
+  const url = `${API_BASE_URL}/images`;
+  const form = new FormData();
+  form.append('file', image);
+  const response = await fetch(url, { method: 'POST', body: form });
+  if (!response.ok) {
+    const errorBody = await response.text();
+    console.error(`Backend error for ${url}:`, errorBody);
+    throw new Error(`Request to ${url} failed.`);
+  }
+  return await response.json();
+};
+
+// Where the browser loads a stored image from (e.g. a recolor result's image_id)
+export const storedImageUrl = (imageId: string) => `${API_BASE_URL}/images/${imageId}`;
+// Where the browser loads a segmentation mask from (its mask_url, e.g. /masks/<id>.png)
+export const maskImageUrl = (maskUrl: string) => `${API_BASE_URL}${maskUrl}`;
+
 // All functions that send data use the POST helper
 export const generateFalImage = (input: { prompt: string }) => callBackendPost('/generate-fal-image', input);
 export const redesignFalImage = (input: { image_url: string; prompt: string }) => callBackendPost('/redesign-fal-image', input);
-export const segment = (input: { image_url: string }) => callBackendPost('/segment', input);
+// Pass inline_masks: false to get mask handles (mask_id, mask_url) without the PNG payloads
+export const segment = (input: { image_url: string; inline_masks?: boolean }) => callBackendPost('/segment', input);
 export const reconstruct = (input: { image_url: string }) => callBackendPost('/reconstruct', input);
+export const submitReconstructJob = (input: { image_url: string }) => callBackendPost('/reconstruct/jobs', input);
+
+// Follow a reconstruction job's Stage 1/4–4/4 progress over Server-Sent Events.
+// A failed job rejects with the server's fallback model attached as `result`.
+export const followReconstructJob = (jobId: string, onProgress: (event: any) => void): Promise<any> =>
+  new Promise((resolve, reject) => {
+    const source = new EventSource(`${API_BASE_URL}/reconstruct/jobs/${jobId}/events`);
+    source.addEventListener('progress', (e) => onProgress(JSON.parse((e as MessageEvent).data)));
+    source.addEventListener('completed', (e) => { source.close(); resolve(JSON.parse((e as MessageEvent).data).result); });
+    source.addEventListener('failed', (e) => {
+      source.close();
+      const data = JSON.parse((e as MessageEvent).data);
+      reject(Object.assign(new Error(data.error), { result: data.result }));
+    });
+    // Don't let EventSource retry forever: a dropped stream fails the wait
+    source.onerror = () => { source.close(); reject(new Error(`Lost progress stream for reconstruction job ${jobId}.`)); };
+  });
 export const recolor = (input: any) => callBackendPost('/recolor', input);
 export const generateVoiceover = (input: { image_url: string; style: string }) => callBackendPost('/generate-voiceover', input);
-export const chatWithAvatar = (input: { message: string; character_name: string; style: string; conversation_history?: any[] }) => callBackendPost('/chat-with-avatar', input);
+// Pass back the session_id from a previous reply to continue that conversation; the server keeps its history.
+export const chatWithAvatar = (input: { message: string; character_name: string; style: string; session_id?: string; conversation_history?: any[] }) => callBackendPost('/chat-with-avatar', input);
+
+// Stream a chat reply token by token; resolves with the same shape as chatWithAvatar plus timings.
+// EventSource can't POST, so the SSE frames are read straight off the fetch body.
+export const streamChatWithAvatar = async (
+  input: { message: string; character_name: string; style: string; session_id?: string; conversation_history?: any[] },
+  onToken: (text: string) => void,
+): Promise<any> => {
+  const url = `${API_BASE_URL}/chat-with-avatar/stream`;
+  const response = await fetch(url, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(input),
+  });
+  if (!response.ok || !response.body) throw new Error(`Request to ${url} failed.`);
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      const event = frame.match(/^event: (.*)$/m)?.[1];
+      const data = JSON.parse(frame.match(/^data: (.*)$/m)?.[1] ?? '{}');
+      if (event === 'token') onToken(data.text);
+      if (event === 'done') return data;
+    }
+  }
+  throw new Error(`Stream from ${url} ended early.`);
+};
+
+// Spoken reply: sentences are voiced while the rest is still being written.
+// onEvent receives token / sentence / audio (base64 mp3 chunk, in order) / audio_end / audio_error events.
+export const streamChatVoice = async (
+  input: { message: string; character_name: string; style: string; character_type: string; conversation_history?: any[] },
+  onEvent: (event: string, data: any) => void,
+): Promise<any> => {
+  const url = `${API_BASE_URL}/chat-with-avatar/voice/stream`;
+  const response = await fetch(url, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(input),
+  });
+  if (!response.ok || !response.body) throw new Error(`Request to ${url} failed.`);
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      const event = frame.match(/^event: (.*)$/m)?.[1] ?? '';
+      const data = JSON.parse(frame.match(/^data: (.*)$/m)?.[1] ?? '{}');
+      if (event === 'done') return data;
+      onEvent(event, data);
+    }
+  }
+  throw new Error(`Stream from ${url} ended early.`);
+};
+
+// One WebSocket per companion session for chat, dialogue and voice. The server keeps the
+// style, character and conversation history, so each turn only sends the new message.
+// Settings changes ride ahead of the next op on the same socket, with no extra round trip.
+export class CompanionSocket {
+  private socket?: WebSocket;
+  private opened?: Promise<WebSocket>;
+  private nextId = 1;
+  private settings: { style?: string; character_name?: string; character_type?: string } = {};
+  private sentSettings = '';
+  private pending = new Map<number, { resolve: (data: any) => void; reject: (error: Error) => void; onToken?: (text: string) => void }>();
+
+  private connect(): Promise<WebSocket> {
+    if (this.opened && this.socket && this.socket.readyState <= WebSocket.OPEN) return this.opened;
+    const url = `${(API_BASE_URL || window.location.origin).replace(/^http/, 'ws')}/companion/ws`;
+    const socket = new WebSocket(url);
+    this.socket = socket;
+    this.sentSettings = ''; // a new socket is a new server session
+    this.opened = new Promise((resolve, reject) => {
+      socket.onopen = () => resolve(socket);
+      socket.onerror = () => reject(new Error(`WebSocket ${url} failed.`));
+    });
+    socket.onmessage = (e) => {
+      const data = JSON.parse(e.data);
+      const call = this.pending.get(data.id);
+      if (!call) return;
+      if (data.event === 'token') call.onToken?.(data.text);
+      else {
+        this.pending.delete(data.id);
+        data.event === 'result' ? call.resolve(data) : call.reject(new Error(data.detail));
+      }
+    };
+    socket.onclose = () => {
+      this.pending.forEach((call) => call.reject(new Error('Companion connection closed.')));
+      this.pending.clear();
+    };
+    return this.opened;
+  }
+
+  async send(op: string, payload: any = {}, onToken?: (text: string) => void): Promise<any> {
+    const socket = await this.connect();
+    const settings = JSON.stringify(this.settings);
+    if (settings !== this.sentSettings) {
+      // The server handles frames in order, so this op already sees the new settings
+      socket.send(JSON.stringify({ id: this.nextId++, op: 'configure', ...this.settings }));
+      this.sentSettings = settings;
+    }
+    const id = this.nextId++;
+    return new Promise((resolve, reject) => {
+      this.pending.set(id, { resolve, reject, onToken });
+      socket.send(JSON.stringify({ id, op, ...payload }));
+    });
+  }
+
+  configure = (settings: { style?: string; character_name?: string; character_type?: string }) => { Object.assign(this.settings, settings); };
+  chat = (message: string, options: { speak?: boolean; onToken?: (text: string) => void } = {}) =>
+    this.send('chat', { message, speak: options.speak }, options.onToken);
+  dialogue = (action: string, message?: string) => this.send('dialogue', { action, message });
+  voice = (message: string, character_type?: string) => this.send('voice', { message, character_type });
+}
 
 // ✅ CORRECTED: A dedicated function for the GET endpoint that expects a JSON response with a "quote" key.
 export const getDesignerQuote = async (): Promise<{ quote: string }> => {
@@ -27,10 +27,14 @@ export default defineConfig({
     open: true,
     proxy: {
       // ✅ UPDATED: Added the new redesign endpoint to the proxy rule.
-      '^/(generate-fal-image|generate-voiceover|segment|recolor|reconstruct|health|description.*\\.mp3|redesign-fal-image|chat-with-avatar|get-designer-quote|generate-character-voice|.*_voice\\.mp3)': {
+      '^/(generate-fal-image|generate-voiceover|segment|recolor|reconstruct|images|masks|health|speech/|redesign-fal-image|chat-with-avatar|get-designer-quote|generate-character-voice)': {
         target: 'http://127.0.0.1:8000',
         changeOrigin: true,
       },
+      '/companion': {
+        target: 'ws://127.0.0.1:8000',
+        ws: true,
+      },
     },
   },
 });
\ No newline at end of file